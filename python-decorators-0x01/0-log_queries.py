@@ -1,29 +1,269 @@
 import sqlite3
 import functools
-from datetime import datetime
+import inspect
+import json
+import logging
+import math
+import re
+import socket
+import threading
+import time
+import zlib
+from bisect import bisect_left
+from collections import deque
+from collections.abc import Iterator
 
-def log_queries(func):
+connections = __import__('1-with_db_connection')
+
+logger = logging.getLogger("log_queries")
+
+
+# empreinte d'une requête : les valeurs littérales sont remplacées par ?
+# pour regrouper "WHERE id = 1" et "WHERE id = 2" sous la même requête
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_IN_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+_SPACES = re.compile(r"\s+")
+
+
+@functools.lru_cache(maxsize=1024)
+def fingerprint(query):
+    query = _LITERALS.sub("?", query)
+    query = _IN_LIST.sub("(?+)", query)
+    return _SPACES.sub(" ", query).strip()
+
+
+# histogramme à seaux géométriques (de 1 µs à ~100 s, +25 % par seau) :
+# mémoire fixe, percentiles précis à 25 % près
+class Histogram:
+    BOUNDS = [1e-6 * 1.25 ** i for i in range(84)]
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, value):
+        self.counts[bisect_left(self.BOUNDS, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, p):
+        if not self.count:
+            return None
+        rank = math.ceil(self.count * p / 100)
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank:
+                return min(self.BOUNDS[i], self.max) if i < len(self.BOUNDS) else self.max
+        return self.max
+
+
+class QueryStats:
+    def __init__(self):
+        self.calls = 0
+        self.rows = 0
+        self.cpu = 0.0
+        self.wall = Histogram()
+
+
+_stats = {}
+_stats_lock = threading.Lock()
+
+
+# statistiques par empreinte : appels, lignes, p50/p95/p99 (secondes)
+def query_stats():
+    with _stats_lock:
+        return {
+            query: {
+                "calls": s.calls,
+                "rows": s.rows,
+                "avg": s.wall.total / s.calls,
+                "p50": s.wall.percentile(50),
+                "p95": s.wall.percentile(95),
+                "p99": s.wall.percentile(99),
+                "max": s.wall.max,
+                "cpu": s.cpu,
+            }
+            for query, s in _stats.items()
+        }
+
+
+def reset_query_stats():
+    with _stats_lock:
+        _stats.clear()
+
+
+# ---- destinations des événements (une par appel) ----
+
+class MemorySink:
+    def __init__(self, maxlen=10000):
+        self.events = deque(maxlen=maxlen)
+
+    def emit(self, event):
+        self.events.append(event)
+
+
+class JsonLinesSink:
+    def __init__(self, path):
+        self.file = open(path, "a", encoding="utf-8")
+        self.lock = threading.Lock()
+
+    def emit(self, event):
+        line = json.dumps(event) + "\n"
+        with self.lock:
+            self.file.write(line)
+
+    def close(self):
+        self.file.close()
+
+
+# format statsd : <prefix>.<empreinte>.duration:<ms>|ms, envoyé en UDP
+# (perdu sans erreur si personne n'écoute)
+class StatsdSink:
+    def __init__(self, host="127.0.0.1", port=8125, prefix="db.query"):
+        self.address = (host, port)
+        self.prefix = prefix
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def emit(self, event):
+        key = f"{self.prefix}.{zlib.crc32(event['query'].encode()):08x}"
+        lines = [f"{key}.duration:{event['wall'] * 1000:.3f}|ms",
+                 f"{key}.calls:1|c"]
+        if event["rows"] is not None:
+            lines.append(f"{key}.rows:{event['rows']}|c")
+        try:
+            self.socket.sendto("\n".join(lines).encode(), self.address)
+        except OSError:
+            pass
+
+    def close(self):
+        self.socket.close()
+
+
+def _query_of(args, kwargs):
+    query = kwargs.get("query")
+    if query is None:
+        query = next((arg for arg in args if isinstance(arg, str)), None)
+    return query
+
+
+def _count_rows(result):
+    if isinstance(result, list):
+        return len(result)
+    if result is None:
+        return 0
+    if isinstance(result, (tuple, sqlite3.Row)):
+        return 1
+    return None
+
+
+def _record(func, sink, slow_query, query, rows, wall, cpu):
+    key = fingerprint(query) if query is not None else func.__name__
+    with _stats_lock:
+        stats = _stats.get(key)
+        if stats is None:
+            stats = _stats[key] = QueryStats()
+        stats.calls += 1
+        stats.rows += rows or 0
+        stats.cpu += cpu
+        stats.wall.add(wall)
+
+    if wall >= slow_query:
+        logger.warning("slow query (%.3fs, %s rows): %s", wall, rows, key)
+    if sink is not None:
+        sink.emit({"ts": time.time(), "function": func.__name__,
+                   "query": key, "wall": wall, "cpu": cpu, "rows": rows})
+
+
+# résultat en flux : on compte les lignes lues et le temps passé à les
+# produire (pas celui de l'appelant entre deux lignes) ; l'appel est
+# enregistré quand le flux est épuisé ou fermé
+def _logged_stream(rows, func, sink, slow_query, query, wall, cpu):
+    count = 0
+    try:
+        while True:
+            cpu_start = time.thread_time()
+            start = time.perf_counter()
+            try:
+                row = next(rows)
+            except StopIteration:
+                break
+            finally:
+                wall += time.perf_counter() - start
+                cpu += time.thread_time() - cpu_start
+            count += 1
+            yield row
+    finally:
+        close = getattr(rows, "close", None)
+        if close is not None:
+            close()
+        _record(func, sink, slow_query, query, count, wall, cpu)
+
+
+# @log_queries ou @log_queries(sink=..., slow_query=0.2) :
+# mesure durée réelle et CPU, lignes rendues, agrège par empreinte de requête,
+# signale les requêtes lentes (logger "log_queries") et envoie un événement
+# au sink s'il y en a un. Un itérateur rendu (stream=True) est suivi
+# jusqu'à sa fin. Sur une coroutine, le CPU mesuré est celui du
+# thread de la boucle pendant l'appel (autres tâches comprises).
+def log_queries(func=None, *, sink=None, slow_query=0.5):
+    if func is None:
+        return lambda f: log_queries(f, sink=sink, slow_query=slow_query)
+
+    if inspect.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def async_wrapper(*args , **kwargs):
+            query = _query_of(args, kwargs)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("SQL Query: %s", query)
+            cpu_start = time.thread_time()
+            start = time.perf_counter()
+            result = await func(*args , **kwargs)
+            _record(func, sink, slow_query, query, _count_rows(result),
+                    time.perf_counter() - start, time.thread_time() - cpu_start)
+            return result
+        return async_wrapper
+
+    @functools.wraps(func)
     def wrapper(*args , **kwargs):
         # on récupère la requête passée à la fonction
-        query = kwargs.get("query")
-        
-        # on affiche la requête
-        print(f"{datetime.now()} - SQL Query: {query}")
+        query = _query_of(args, kwargs)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("SQL Query: %s", query)
 
-        # on exécute la vraie fonction
-        return func(*args , **kwargs)
+        # on exécute la vraie fonction en la chronométrant
+        cpu_start = time.thread_time()
+        start = time.perf_counter()
+        result = func(*args , **kwargs)
+        wall = time.perf_counter() - start
+        cpu = time.thread_time() - cpu_start
+        if (result is not None and not isinstance(result, (list, tuple))
+                and isinstance(result, Iterator)):
+            return _logged_stream(result, func, sink, slow_query, query, wall, cpu)
+        _record(func, sink, slow_query, query, _count_rows(result), wall, cpu)
+        return result
 
     return wrapper
 
 
+# stream=True : générateur de lignes lues par paquets de batch_size, la
+# connexion est fermée quand il est épuisé ou fermé
 @log_queries
-def fetch_all_users(query):
+def fetch_all_users(query, stream=False, batch_size=1000):
     conn = sqlite3.connect('users.db')
     cursor = conn.cursor()
     cursor.execute(query)
+    if stream:
+        return connections.Stream(connections.stream_rows(cursor, batch_size),
+                                  conn.close)
     results = cursor.fetchall()
     conn.close()
     return results
 
-#### fetch users while logging the query
-users = fetch_all_users(query="SELECT * FROM users")
+if __name__ == "__main__":
+    #### fetch users while logging the query
+    users = fetch_all_users(query="SELECT * FROM users")
@@ -1,23 +1,576 @@
 import sqlite3
+import asyncio
+import contextlib
 import functools
+import inspect
+import queue
+import threading
+import types
+from collections import OrderedDict
+from urllib.parse import parse_qsl, quote, urlencode
+
+DATABASE = "users.db"
+
+# réglages appliqués une seule fois, à l'ouverture de chaque connexion
+PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "cache_size": -20000,          # 20 Mo
+    "mmap_size": 268435456,        # 256 Mo
+}
+
+
+_WRITES = {sqlite3.SQLITE_INSERT, sqlite3.SQLITE_UPDATE, sqlite3.SQLITE_DELETE}
+
+
+# sqlite3 garde déjà, par connexion, un LRU de requêtes préparées (taille
+# cached_statements) : une requête déjà vue n'est pas analysée à nouveau.
+# StatementCache rejoue le même LRU pour compter les hits/misses, et garde
+# pour chaque requête les tables qu'elle écrit.
+class StatementCache:
+    def __init__(self, size):
+        self.size = size
+        self._sql = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def touch(self, sql):
+        if sql in self._sql:
+            self._sql.move_to_end(sql)
+            self.hits += 1
+            return
+        self.misses += 1
+        if self.size <= 0:
+            return
+        self._sql[sql] = frozenset()
+        if len(self._sql) > self.size:
+            self._sql.popitem(last=False)
+            self.evictions += 1
+
+    # tables écrites par une requête préparée (vues par l'autorisateur)
+    def writes(self, sql):
+        return self._sql.get(sql, frozenset())
+
+    def record(self, sql, tables):
+        if sql in self._sql:
+            self._sql[sql] = self._sql[sql] | tables
+
+    def stats(self):
+        return {"size": self.size, "entries": len(self._sql), "hits": self.hits,
+                "misses": self.misses, "evictions": self.evictions}
+
+
+class CachedCursor(sqlite3.Cursor):
+    def execute(self, sql, parameters=()):
+        connection = self.connection
+        connection.statements.touch(sql)
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            connection.note_writes(sql)
+
+    def executemany(self, sql, seq_of_parameters):
+        connection = self.connection
+        connection.statements.touch(sql)
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            connection.note_writes(sql)
+
+
+# connexion sqlite3 normale dont les curseurs passent par le cache.
+# L'autorisateur est posé une seule fois : il n'est appelé qu'à la
+# préparation d'une requête, et le changer forcerait à préparer à nouveau
+# toutes les requêtes en cache. Les tables écrites sont donc gardées par
+# requête dans StatementCache ; `written` (posé par @transactional) reçoit
+# celles de chaque requête exécutée.
+class CachedConnection(sqlite3.Connection):
+    def __init__(self, *args, cached_statements=128, **kwargs):
+        super().__init__(*args, cached_statements=cached_statements, **kwargs)
+        self.statements = StatementCache(cached_statements)
+        self.written = None
+        self._prepared = set()
+        self.set_authorizer(self._authorize)
+
+    def _authorize(self, action, table, *rest):
+        if action in _WRITES and table:
+            self._prepared.add(table.lower())
+        return sqlite3.SQLITE_OK
+
+    def note_writes(self, sql):
+        prepared = self._prepared
+        if prepared:
+            tables = frozenset(prepared)
+            prepared.clear()
+            self.statements.record(sql, tables)
+        else:
+            tables = self.statements.writes(sql)
+        if tables and self.written is not None:
+            self.written.update(tables)
+
+    def cursor(self, factory=CachedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+# mode=ro est toujours imposé, même sur une URI "file:" qui ne le donne pas
+# (ou demande mode=rw) ; un chemin simple est échappé : "?" et "#" y seraient
+# lus comme début de la requête ou du fragment de l'URI
+def read_only_uri(database):
+    if not database.startswith("file:"):
+        return f"file:{quote(database, safe='/')}?mode=ro"
+    uri, _, _ = database.partition("#")
+    path, _, query = uri.partition("?")
+    params = [(name, value)
+              for name, value in parse_qsl(query, keep_blank_values=True)
+              if name != "mode"]
+    return f"{path}?{urlencode(params + [('mode', 'ro')], safe='/')}"
+
+
+# read_only=True : ouverture par URI "file:...?mode=ro" ; le mode du journal
+# reste celui fixé par la base principale, query_only refuse toute écriture
+def open_connection(database=DATABASE, pragmas=PRAGMAS, statement_cache=128,
+                    read_only=False):
+    if read_only:
+        database = read_only_uri(database)
+        pragmas = {name: value for name, value in pragmas.items()
+                   if name != "journal_mode"}
+        pragmas["query_only"] = "ON"
+    connection = sqlite3.connect(database, check_same_thread=False,
+                                 factory=CachedConnection,
+                                 cached_statements=statement_cache,
+                                 uri=database.startswith("file:"))
+    for name, value in pragmas.items():
+        connection.execute(f"PRAGMA {name} = {value}")
+    return connection
+
+
+# pool partagé entre threads : au plus max_size connexions ouvertes, les
+# autres appelants attendent qu'une connexion soit rendue
+class ConnectionPool:
+    def __init__(self, database=DATABASE, max_size=8, timeout=30.0,
+                 pragmas=PRAGMAS, statement_cache=128, read_only=False):
+        self.database = database
+        self.max_size = max_size
+        self.timeout = timeout
+        self.pragmas = pragmas
+        self.statement_cache = statement_cache
+        self.read_only = read_only
+        self._connections = []
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._size = 0
+        self.in_use = 0
+        self.stats = {"created": 0, "checkouts": 0, "waits": 0}
+
+    # compteurs (stats, in_use) et liste des connexions modifiés sous
+    # self._lock : lus par statement_stats() et least_loaded pendant que
+    # d'autres threads empruntent
+    def acquire(self):
+        connection = self._checkout()
+        with self._lock:
+            self.in_use += 1
+            self.stats["checkouts"] += 1
+        return connection
+
+    def _checkout(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            create = self._size < self.max_size
+            if create:
+                self._size += 1
+            else:
+                self.stats["waits"] += 1
+        if create:
+            try:
+                connection = open_connection(self.database, self.pragmas,
+                                             self.statement_cache,
+                                             self.read_only)
+            except Exception:
+                with self._lock:
+                    self._size -= 1
+                raise
+            with self._lock:
+                self.stats["created"] += 1
+                self._connections.append(connection)
+            return connection
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise TimeoutError(
+                f"no connection available after {self.timeout}s") from None
+
+    def release(self, connection):
+        # une transaction laissée ouverte ne doit pas passer au suivant
+        if connection.in_transaction:
+            connection.rollback()
+        with self._lock:
+            self.in_use -= 1
+        self._idle.put(connection)
+
+    def close(self):
+        while True:
+            try:
+                connection = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            connection.close()
+            with self._lock:
+                self._size -= 1
+                self._connections.remove(connection)
+
+    # hits/misses du cache de requêtes, toutes connexions du pool confondues
+    def statement_stats(self):
+        total = {"hits": 0, "misses": 0, "evictions": 0}
+        with self._lock:
+            connections = list(self._connections)
+        for connection in connections:
+            for key in total:
+                total[key] += getattr(connection.statements, key)
+        return total
+
+
+_pool = None
+_pooled = True
+_pool_options = {}
+_replicas = []
+_strategy = "round_robin"
+_next_replica = 0
+
+
+# changer de base ou de réglages ; enabled=False revient à une connexion
+# neuve par appel.
+# replicas : bases (chemins ou URI "file:") lues par les fonctions marquées
+# @read_only, ouvertes en lecture seule, chacune avec son pool ; une même
+# base peut apparaître plusieurs fois pour séparer les lecteurs du pool
+# d'écriture. strategy : "round_robin" ou "least_loaded" (moins de
+# connexions empruntées).
+def configure_pool(enabled=True, replicas=(), strategy="round_robin", **options):
+    global _pool, _pooled, _pool_options, _apool, _apool_loop
+    global _replicas, _strategy, _next_replica
+    if strategy not in ("round_robin", "least_loaded"):
+        raise ValueError(f"unknown strategy: {strategy!r}")
+    if _pool is not None:
+        _pool.close()
+    for replica in _replicas:
+        replica.close()
+    if _apool is not None:
+        _apool.discard()
+    _pool = _apool = _apool_loop = None
+    _pooled = enabled
+    _pool_options = options
+    _replicas = [ConnectionPool(**dict(options, database=database, read_only=True))
+                 for database in replicas]
+    _strategy = strategy
+    _next_replica = 0
+
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        _pool = ConnectionPool(**_pool_options)
+    return _pool
+
+
+# pool de lecture choisi pour un appel ; la base principale s'il n'y a pas
+# de réplique
+def get_read_pool():
+    global _next_replica
+    replicas = _replicas
+    if not replicas:
+        return get_pool()
+    if _strategy == "least_loaded":
+        return min(replicas, key=lambda pool: pool.in_use)
+    index = _next_replica % len(replicas)
+    _next_replica = index + 1
+    return replicas[index]
+
+
+# pools de lecture (stats par réplique)
+def read_pools():
+    return list(_replicas)
+
+
+def _acquire():
+    if not _pooled:
+        return sqlite3.connect(_pool_options.get("database", DATABASE))
+    return get_pool().acquire()
+
+
+def _release(connection):
+    if not _pooled:
+        connection.close()
+    else:
+        get_pool().release(connection)
+
+
+# @read_only : la fonction ne fait que lire, with_db_connection peut lui
+# donner une connexion d'une réplique. Ignoré sous @transactional, qui
+# marque ses fonctions comme écritures.
+def read_only(func):
+    func.read_only = True
+    return func
+
+
+# connexion "épinglée" : pendant le bloc, with_db_connection donne toujours
+# cette connexion au thread courant (shared=True : à tous les threads)
+_local = threading.local()
+_shared = None
+
+
+@contextlib.contextmanager
+def pinned_connection(shared=False):
+    global _shared
+    connection = _acquire()
+    if shared:
+        _shared = connection
+    else:
+        previous = getattr(_local, "connection", None)
+        _local.connection = connection
+    try:
+        yield connection
+    finally:
+        if shared:
+            _shared = None
+        else:
+            _local.connection = previous
+        _release(connection)
+
+
+# lignes d'un curseur par paquets de batch_size (fetchmany) : la mémoire
+# reste bornée quelle que soit la taille du résultat
+def stream_rows(cursor, batch_size=1000):
+    try:
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                return
+            yield from rows
+    finally:
+        cursor.close()
+
+
+# itérateur qui garde une connexion empruntée tant qu'il n'est pas épuisé ;
+# release() est appelé à la fin, à close() (ou en sortie de with) ou quand
+# l'itérateur est abandonné
+class Stream:
+    def __init__(self, rows, release):
+        self._rows = iter(rows)
+        self._release = release
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._release is None:
+            raise StopIteration
+        try:
+            return next(self._rows)
+        except BaseException:
+            self.close()
+            raise
+
+    def close(self):
+        release, self._release = self._release, None
+        if release is None:
+            return
+        try:
+            close = getattr(self._rows, "close", None)
+            if close is not None:
+                close()
+        finally:
+            release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __del__(self):
+        self.close()
+
+
+_STREAMS = (types.GeneratorType, Stream)
+
+
+# pool=None : pool principal (ou connexion directe sans pool)
+def _give_back(pool, connection):
+    if pool is None:
+        _release(connection)
+    else:
+        pool.release(connection)
+
+
+# ---- version asynchrone (aiosqlite) ----
+
+async def aopen_connection(database=DATABASE, pragmas=PRAGMAS, statement_cache=128):
+    import aiosqlite
+    # CachedConnection : tables écrites relevées sans autorisateur posé à
+    # chaque transaction (voir 2-transactional)
+    connection = await aiosqlite.connect(database, factory=CachedConnection,
+                                         cached_statements=statement_cache)
+    for name, value in pragmas.items():
+        await connection.execute(f"PRAGMA {name} = {value}")
+    return connection
+
+
+# même pool, côté asyncio : les appelants attendent sans bloquer la boucle.
+# Les connexions aiosqlite ont chacune un thread : fermer le pool avant de
+# quitter (await close_async_pool()).
+class AsyncConnectionPool:
+    def __init__(self, database=DATABASE, max_size=8, timeout=30.0,
+                 pragmas=PRAGMAS, statement_cache=128):
+        self.database = database
+        self.max_size = max_size
+        self.timeout = timeout
+        self.pragmas = pragmas
+        self.statement_cache = statement_cache
+        self._idle = asyncio.LifoQueue()
+        self._size = 0
+        self.stats = {"created": 0, "checkouts": 0, "waits": 0}
+
+    async def acquire(self):
+        self.stats["checkouts"] += 1
+        if not self._idle.empty():
+            return self._idle.get_nowait()
+        if self._size < self.max_size:
+            self._size += 1
+            try:
+                connection = await aopen_connection(self.database, self.pragmas,
+                                                    self.statement_cache)
+            except BaseException:
+                self._size -= 1
+                raise
+            self.stats["created"] += 1
+            return connection
+        self.stats["waits"] += 1
+        try:
+            return await asyncio.wait_for(self._idle.get(), self.timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError(
+                f"no connection available after {self.timeout}s") from None
+
+    async def release(self, connection):
+        if connection.in_transaction:
+            await connection.rollback()
+        self._idle.put_nowait(connection)
+
+    async def close(self):
+        while not self._idle.empty():
+            await self._idle.get_nowait().close()
+            self._size -= 1
+
+    # fermeture sans boucle active (pool d'une boucle terminée)
+    def discard(self):
+        while not self._idle.empty():
+            self._idle.get_nowait().stop()
+            self._size -= 1
+
+
+_apool = None
+_apool_loop = None
+
+
+# générateur asynchrone laissé suspendu : la boucle le ferme à son arrêt
+# (shutdown_asyncgens, appelé par asyncio.run), ce qui ferme le pool même
+# sans close_async_pool() ; sinon les threads aiosqlite bloquent la sortie
+async def _close_at_shutdown(pool):
+    try:
+        yield
+    finally:
+        await pool.close()
+
+
+async def _start(generator):
+    await generator.__anext__()
+
+
+# un pool par boucle : les files asyncio sont liées à la boucle qui les utilise
+def get_async_pool():
+    global _apool, _apool_loop
+    loop = asyncio.get_running_loop()
+    if _apool is None or _apool_loop is not loop:
+        if _apool is not None:
+            _apool.discard()
+        _apool = AsyncConnectionPool(**_pool_options)
+        _apool_loop = loop
+        _apool.closer = _close_at_shutdown(_apool)
+        loop.create_task(_start(_apool.closer))
+    return _apool
+
+
+async def close_async_pool():
+    global _apool, _apool_loop
+    if _apool is not None:
+        await _apool.close()
+    _apool = _apool_loop = None
+
+
+async def _aacquire():
+    if not _pooled:
+        return await aopen_connection(_pool_options.get("database", DATABASE), {})
+    return await get_async_pool().acquire()
+
+
+async def _arelease(connection):
+    if not _pooled:
+        await connection.close()
+    else:
+        await get_async_pool().release(connection)
 
 
 def with_db_connection(func):
+    if inspect.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def async_wrapper(*args ,**kwargs):
+            connection = await _aacquire()
+            try:
+                return await func(connection , *args , **kwargs)
+            finally:
+                await _arelease(connection)
+        return async_wrapper
+
+    reads = getattr(func, "read_only", False) and not getattr(func, "writes", False)
+
+    @functools.wraps(func)
     def wrapper(*args ,**kwargs):
-        connection = sqlite3.connect('users_db')
-       try:
-          return func(connection , *args , **kwargs)
-       finally:
-          connection.close()
-    return wrapper 
-
-@with_db_connection 
-def get_user_by_id(conn, user_id): 
-cursor = conn.cursor() 
-cursor.execute("SELECT * FROM users WHERE id = ?", (user_id,)) 
-return cursor.fetchone() 
-#### Fetch user by ID with automatic connection handling 
-
-user = get_user_by_id(user_id=1)
-print(user)
+        pinned = getattr(_local, "connection", None) or _shared
+        if pinned is not None:
+            return func(pinned , *args , **kwargs)
+
+        pool = get_read_pool() if reads and _pooled and _replicas else None
+        connection = _acquire() if pool is None else pool.acquire()
+        try:
+            result = func(connection , *args , **kwargs)
+        except BaseException:
+            _give_back(pool, connection)
+            raise
+        # un générateur lit encore la connexion : elle est rendue à la fin
+        if isinstance(result, _STREAMS):
+            return Stream(result, functools.partial(_give_back, pool, connection))
+        _give_back(pool, connection)
+        return result
+    return wrapper
+
+@with_db_connection
+@read_only
+def get_user_by_id(conn, user_id):
+    cursor = conn.cursor()
+    cursor.execute("SELECT * FROM users WHERE id = ?", (user_id,))
+    return cursor.fetchone()
+
+if __name__ == "__main__":
+    #### Fetch user by ID with automatic connection handling
 
+    user = get_user_by_id(user_id=1)
+    print(user)
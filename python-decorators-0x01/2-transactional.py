@@ -1,23 +1,288 @@
 import sqlite3
-import functools 
+import contextlib
+import functools
+import inspect
+import logging
+import threading
 
-def with_db_connection(func):
-    def wrapper(*args ,**kwargs):
-        conn = sqlite3.connect('users.db')
-        try: return func(conn , *args, **kwargs)
-        finally: conn.close()
+# connexion prise dans le pool partagé de 1-with_db_connection (requêtes
+# préparées gardées d'un appel à l'autre)
+connections = __import__('1-with_db_connection')
+with_db_connection = connections.with_db_connection
+
+
+# appelées après chaque commit avec l'ensemble des tables modifiées
+# (4-cache_query s'y inscrit pour invalider ses résultats)
+commit_listeners = []
+
+_WRITES = connections._WRITES
+
+logger = logging.getLogger("transactional")
+
+
+# connexion du pool (CachedConnection) : son autorisateur permanent remplit
+# conn.written. Autre connexion : autorisateur posé le temps de l'appel (le
+# poser force la re-préparation des requêtes en cache, donc il voit aussi
+# les requêtes déjà préparées), triggers compris dans les deux cas
+def _authorizer(written):
+    def authorizer(action, table, *rest):
+        if action in _WRITES and table:
+            written.add(table.lower())
+        return sqlite3.SQLITE_OK
+    return authorizer
+
+
+def _track_writes(conn, written):
+    if isinstance(conn, connections.CachedConnection):
+        conn.written = written
+    else:
+        conn.set_authorizer(_authorizer(written))
+
+
+def _untrack_writes(conn):
+    if isinstance(conn, connections.CachedConnection):
+        conn.written = None
+    else:
+        conn.set_authorizer(None)
+
+
+def _notify(written):
+    if written:
+        for listener in commit_listeners:
+            listener(written)
+
+
+# plusieurs appels @transactional dans une seule transaction : chacun tourne
+# dans un SAVEPOINT, un échec n'annule que son propre travail. Le nom est
+# toujours le même (les appels sont sérialisés par le verrou, et SQLite vise
+# le SAVEPOINT le plus récent de ce nom) : trois requêtes dans le cache de
+# requêtes préparées au lieu de trois nouvelles par appel
+class _Batch:
+    def __init__(self, conn):
+        self.conn = conn
+        self.written = set()
+        self.lock = threading.RLock()
+        _track_writes(conn, self.written)
+
+    def run(self, func, conn, args, kwargs):
+        with self.lock:
+            if not conn.in_transaction:
+                conn.execute("BEGIN")
+            conn.execute("SAVEPOINT tx")
+            try:
+                result = func(conn, *args, **kwargs)
+            except Exception:
+                conn.execute("ROLLBACK TO tx")
+                conn.execute("RELEASE tx")
+                raise
+            conn.execute("RELEASE tx")
+            return result
+
+    def commit(self):
+        with self.lock:
+            self.conn.commit()
+            written = set(self.written)
+            self.written.clear()
+        _notify(written)
+
+    def close(self):
+        _untrack_writes(self.conn)
+
+
+_local = threading.local()
+_group = None
+
+
+def _current_batch(conn):
+    batch = getattr(_local, "batch", None)
+    if batch is not None and batch.conn is conn:
+        return batch
+    if _group is not None and _group.conn is conn:
+        return _group
+    return None
+
+
+# vrai si conn porte un batch() ou un GroupCommit en cours : ses lectures
+# voient des écritures pas encore validées
+def in_batch(conn):
+    return _current_batch(conn) is not None
+
+
+# with batch(): ... : tous les appels @transactional du bloc (dans ce
+# thread) partagent une transaction validée une seule fois à la fin
+@contextlib.contextmanager
+def batch():
+    with connections.pinned_connection() as conn:
+        current = _Batch(conn)
+        previous = getattr(_local, "batch", None)
+        _local.batch = current
+        try:
+            yield conn
+            current.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            _local.batch = previous
+            current.close()
+
+
+class _Generation:
+    def __init__(self):
+        self.done = threading.Event()
+        self.error = None
+
+
+# validation groupée en tâche de fond, pour tous les threads : un commit
+# toutes les `every` opérations ou toutes les `interval` secondes.
+# wait=True : chaque appel attend que le commit qui le contient soit fait
+# (durabilité conservée, un fsync pour tout le groupe) ; un appel imbriqué
+# dans un autre appel @transactional n'attend pas, c'est l'appel extérieur
+# qui attend (il tient le verrou dont le commit a besoin).
+# wait=False : les appels rendent la main avant le commit ; un commit raté
+# est journalisé et la première erreur est levée par __exit__
+class GroupCommit(_Batch):
+    def __init__(self, every=100, interval=0.05, wait=True):
+        self.every = every
+        self.interval = interval
+        self.wait = wait
+        self._depth = threading.local()
+        self._error = None
+        self._pinned = None
+        self._pending = 0
+        self._generation = _Generation()
+        self._wakeup = threading.Event()
+        self._stopping = False
+        self._thread = None
+
+    def __enter__(self):
+        global _group
+        self._pinned = connections.pinned_connection(shared=True)
+        super().__init__(self._pinned.__enter__())
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+        _group = self
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        global _group
+        _group = None
+        self._stopping = True
+        self._wakeup.set()
+        self._thread.join()
+        self.close()
+        self._pinned.__exit__(exc_type, exc_value, traceback)
+        if self._error is not None and exc_type is None:
+            raise self._error
+
+    def run(self, func, conn, args, kwargs):
+        depth = getattr(self._depth, "value", 0)
+        self._depth.value = depth + 1
+        try:
+            with self.lock:
+                result = super().run(func, conn, args, kwargs)
+                generation = self._generation
+                self._pending += 1
+                if self._pending >= self.every:
+                    self._wakeup.set()
+        finally:
+            self._depth.value = depth
+        if self.wait and depth == 0:
+            generation.done.wait()
+            if generation.error is not None:
+                raise generation.error
+        return result
+
+    def flush(self):
+        with self.lock:
+            generation, self._generation = self._generation, _Generation()
+            self._pending = 0
+            try:
+                self.commit()
+            except Exception as error:
+                self.conn.rollback()
+                generation.error = error
+                if not self.wait:
+                    # personne n'attend ce commit : journalisé ici, levé
+                    # par __exit__
+                    logger.error("group commit failed, writes lost: %s", error)
+                    if self._error is None:
+                        self._error = error
+        generation.done.set()
+
+    def _loop(self):
+        while not self._stopping:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            self.flush()
+        self.flush()
+
+
+# connexion sqlite3 portée par une connexion aiosqlite (aiosqlite n'y donne
+# pas d'accès public)
+def _sqlite_connection(conn):
+    return getattr(conn, "_connection", None)
+
+
+def _async_transactional(func):
+    @functools.wraps(func)
+    async def wrapper(conn , *args , **kwargs):
+        written = set()
+        # connexion de aopen_connection : même relevé que côté synchrone ;
+        # autre connexion aiosqlite : autorisateur posé le temps de l'appel
+        raw = _sqlite_connection(conn)
+        cached = isinstance(raw, connections.CachedConnection)
+        if commit_listeners:
+            if cached:
+                _track_writes(raw, written)
+            else:
+                await conn.set_authorizer(_authorizer(written))
+        try:
+           result=await func(conn , *args , **kwargs)
+           await conn.commit()
+        except BaseException:
+           await conn.rollback()
+           raise
+        finally:
+           if commit_listeners:
+              if cached:
+                 _untrack_writes(raw)
+              else:
+                 await conn.set_authorizer(None)
+        _notify(written)
+        return result
+    wrapper.writes = True
     return wrapper
 
 
+# marque aussi la fonction comme écriture : with_db_connection l'envoie
+# toujours sur la base principale, même si elle est marquée @read_only
 def transactional(func):
-    def wrapper(*args , **kwargs):
+    if inspect.iscoroutinefunction(func):
+        return _async_transactional(func)
+
+    @functools.wraps(func)
+    def wrapper(conn , *args , **kwargs):
+        grouped = _current_batch(conn)
+        if grouped is not None:
+            return grouped.run(func, conn, args, kwargs)
+
+        written = set()
+        if commit_listeners:
+            _track_writes(conn, written)
         try:
            result=func(conn , *args , **kwargs)
            conn.commit()
-           return result
-        except 
+        except Exception:
            conn.rollback()
            raise
+        finally:
+           if commit_listeners:
+              _untrack_writes(conn)
+        _notify(written)
+        return result
+    wrapper.writes = True
+    return wrapper
 
 
 
@@ -25,10 +290,11 @@ def transactional(func):
 
 @with_db_connection
 @transactional
-def update_user_email(conn, user_id, new_email): 
-cursor = conn.cursor() 
-cursor.execute("UPDATE users SET email = ? WHERE id = ?", (new_email, user_id)) 
-#### Update user's email with automatic transaction handling 
+def update_user_email(conn, user_id, new_email):
+    cursor = conn.cursor()
+    cursor.execute("UPDATE users SET email = ? WHERE id = ?", (new_email, user_id))
 
-update_user_email(user_id=1, new_email='Crawford_Cartwright@hotmail.com')
+if __name__ == "__main__":
+    #### Update user's email with automatic transaction handling
 
+    update_user_email(user_id=1, new_email='Crawford_Cartwright@hotmail.com')
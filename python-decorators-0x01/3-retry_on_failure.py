@@ -1,32 +1,211 @@
-import time 
+import time
+import asyncio
 import sqlite3
 import functools
+import inspect
+import logging
+import random
+import threading
 
+connections = __import__('1-with_db_connection')
+with_db_connection = connections.with_db_connection
+read_only = connections.read_only
+
+logger = logging.getLogger("retry_on_failure")
+
+# erreurs MySQL passagères : deadlock, délai d'attente de verrou dépassé
+MYSQL_TRANSIENT = {1213, 1205}
+SQLITE_TRANSIENT = ("database is locked", "database table is locked",
+                    "database is busy")
+
+
+# vrai si une nouvelle tentative a des chances de réussir
+def is_transient(error):
+    if isinstance(error, sqlite3.OperationalError):
+        message = str(error).lower()
+        return any(text in message for text in SQLITE_TRANSIENT)
+    return getattr(error, "errno", None) in MYSQL_TRANSIENT
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+# budget de nouvelles tentatives partagé entre appels : chaque appel gagne
+# `ratio` jeton, chaque nouvelle tentative en coûte un. Quand la base sature,
+# les tentatives ne peuvent pas dépasser ~ratio x le trafic normal.
+class RetryBudget:
+    def __init__(self, ratio=0.2, initial=10.0, max_tokens=100.0):
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self.tokens = initial
+        self._lock = threading.Lock()
+
+    def deposit(self):
+        if self.tokens >= self.max_tokens:      # plein : pas de verrou
+            return
+        with self._lock:
+            self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def withdraw(self):
+        with self._lock:
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+# disjoncteur : après `threshold` échecs d'affilée, les appels échouent
+# tout de suite pendant `cooldown` secondes, puis un appel d'essai passe
+class CircuitBreaker:
+    def __init__(self, threshold=5, cooldown=30.0):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    # lectures sans verrou tant que le circuit est fermé et sans échec :
+    # le verrou ne sert qu'aux changements d'état
+    def allow(self):
+        if self.opened_at is None:
+            return True
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at >= self.cooldown:
+                self.opened_at = time.monotonic()     # un seul appel d'essai
+                return True
+            return False
+
+    def success(self):
+        if not self.failures and self.opened_at is None:
+            return
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+
+
+default_budget = RetryBudget()
+default_breaker = CircuitBreaker()
+
+retry_stats = {"calls": 0, "attempts": 0, "retries": 0, "failures": 0,
+               "wait_seconds": 0.0, "budget_exhausted": 0, "rejected": 0}
+_stats_lock = threading.Lock()
+
+
+def _count(**values):
+    with _stats_lock:
+        for name, value in values.items():
+            retry_stats[name] += value
+
+
+# délai : backoff exponentiel "full jitter", tiré au hasard entre 0 et
+# min(max_delay, delay * 2**tentative) pour désynchroniser les clients.
+# Sur une coroutine, l'attente passe par asleep (asyncio.sleep par défaut).
+def retry_on_failure(retries=3 ,delay=2, max_delay=30.0, retry_on=is_transient,
+                     budget=default_budget, breaker=default_breaker,
+                     sleep=time.sleep, asleep=asyncio.sleep):
+    if retries < 1:
+        raise ValueError(f"retries must be at least 1, got {retries}")
+
+    def start(func):
+        if breaker is not None and not breaker.allow():
+            _count(rejected=1)
+            raise CircuitOpenError(f"{func.__name__}: circuit open")
+        if budget is not None:
+            budget.deposit()
+
+    # après un échec : délai avant la tentative suivante, ou None s'il faut
+    # abandonner (l'appelant relance alors l'erreur d'origine)
+    def backoff(error, attempt):
+        transient = retry_on(error)
+        if breaker is not None and transient:
+            breaker.failure()
+        last = attempt + 1 == retries
+        if not transient or last:
+            _count(failures=1)
+            return None
+        if budget is not None and not budget.withdraw():
+            _count(failures=1, budget_exhausted=1)
+            return None
+        wait = random.uniform(0, min(max_delay, delay * 2 ** attempt))
+        logger.warning("Attempt %d failed (%s), retrying in %.3fs",
+                       attempt + 1, error, wait)
+        _count(retries=1, wait_seconds=wait)
+        return wait
+
+    def succeeded():
+        if breaker is not None:
+            breaker.success()
 
-def retry_on_failure(retries=3 ,delay=2):
     def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args,**kwargs):
+                attempts = 0
+                try:
+                    start(func)
+                    for attempt in range(retries):
+                        attempts = attempt + 1
+                        try:
+                            result = await func(*args,**kwargs)
+                        except Exception as e:
+                            wait = backoff(e, attempt)
+                            if wait is None:
+                                raise
+                            await asleep(wait)
+                        else:
+                            succeeded()
+                            return result
+                finally:
+                    _count(calls=1, attempts=attempts)
+            return async_wrapper
+
+        @functools.wraps(func)
         def wrapper(*args,**kwargs):
-            for attemp in range(retries):
-                try:  return func(*args,**kwargs)
-                except Exception as e:
-                       print("Attempt {attempt +1} failled {e}")
-                       time.sleep(delay)
-            # après les tentatives, on relance l'erreur
-            raise Exception("Function failed after {retries} retries")
+            # compteurs mis à jour une seule fois, à la fin de l'appel
+            attempts = 0
+            try:
+                start(func)
+                for attempt in range(retries):
+                    attempts = attempt + 1
+                    try:
+                        result = func(*args,**kwargs)
+                    except Exception as e:
+                        wait = backoff(e, attempt)
+                        if wait is None:
+                            raise
+                        sleep(wait)
+                    else:
+                        succeeded()
+                        return result
+            finally:
+                _count(calls=1, attempts=attempts)
         return wrapper
     return decorator
 
 
-
+# stream=True : les lignes arrivent par paquets de batch_size ; seule
+# l'exécution de la requête est retentée, pas la lecture du flux
 @with_db_connection
 @retry_on_failure(retries=3, delay=1)
+@read_only
+def fetch_users_with_retry(conn, stream=False, batch_size=1000):
+    cursor = conn.cursor()
+    cursor.execute("SELECT * FROM users")
+    if stream:
+        return connections.stream_rows(cursor, batch_size)
+    return cursor.fetchall()
 
-def fetch_users_with_retry(conn):
-cursor = conn.cursor()
-cursor.execute("SELECT * FROM users")
-return cursor.fetchall()
-
-#### attempt to fetch users with automatic retry on failure
+if __name__ == "__main__":
+    #### attempt to fetch users with automatic retry on failure
 
-users = fetch_users_with_retry()
-print(users)
+    users = fetch_users_with_retry()
+    print(users)
@@ -1,39 +1,559 @@
 import time
+import asyncio
 import sqlite3
 import functools
+import hashlib
+import inspect
+import marshal
+import re
+import sys
+import threading
+from collections import OrderedDict
+from collections.abc import Iterator
 
+connections = __import__('1-with_db_connection')
+with_db_connection = connections.with_db_connection
+read_only = connections.read_only
+transactional = __import__('2-transactional')
 
-def with_db_connection(func)
-    def wrapper(*args , **kwargs):
-        conn=sqlite3.connect('users.db')
-        try:  return func(conn,*args,**kwargs)
-        finally conn.close()
+# tables lues par une requête (FROM / JOIN), pour l'invalidation
+_TABLES = re.compile(r"\b(?:FROM|JOIN)\s+[\"`\[]?(\w+)", re.IGNORECASE)
+
+
+def tables_of(query):
+    return frozenset(name.lower() for name in _TABLES.findall(query))
+
+
+# taille approximative d'un résultat (liste de tuples) en octets
+def approx_size(value):
+    size = sys.getsizeof(value)
+    if isinstance(value, (list, tuple)):
+        for row in value:
+            size += sys.getsizeof(row)
+            if isinstance(row, (list, tuple)):
+                size += sum(sys.getsizeof(item) for item in row)
+    return size
+
+
+class _Entry:
+    __slots__ = ("value", "expires", "size", "tables")
+
+    def __init__(self, value, expires, size, tables):
+        self.value = value
+        self.expires = expires
+        self.size = size
+        self.tables = tables
+
+
+# cache borné : LRU par nombre d'entrées et par octets, durée de vie par
+# entrée, et invalidation par table
+class QueryCache:
+    def __init__(self, max_entries=1024, max_bytes=64 * 1024 * 1024, ttl=300.0):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._by_table = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0,
+                       "expirations": 0, "invalidations": 0}
+
+    def __contains__(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and entry.expires > time.monotonic()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self._bytes -= entry.size
+        for table in entry.tables:
+            keys = self._by_table.get(table)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_table[table]
+        return entry
+
+    # rend (True, valeur) ou (False, None) ; count=False : sans toucher aux
+    # statistiques hits/misses
+    def lookup(self, key, count=True):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires <= time.monotonic():
+                self._remove(key)
+                self._stats["expirations"] += 1
+                entry = None
+            if entry is None:
+                if count:
+                    self._stats["misses"] += 1
+                return False, None
+            self._entries.move_to_end(key)
+            if count:
+                self._stats["hits"] += 1
+            return True, entry.value
+
+    def put(self, key, value, tables=frozenset(), ttl=None):
+        size = approx_size(value)
+        if size > self.max_bytes:
+            return
+        expires = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = _Entry(value, expires, size, tables)
+            self._bytes += size
+            for table in tables:
+                self._by_table.setdefault(table, set()).add(key)
+            while (len(self._entries) > self.max_entries
+                   or self._bytes > self.max_bytes):
+                self._remove(next(iter(self._entries)))
+                self._stats["evictions"] += 1
+
+    # supprime toutes les entrées qui lisent l'une de ces tables
+    def invalidate(self, *tables):
+        with self._lock:
+            for table in tables:
+                for key in list(self._by_table.get(table.lower(), ())):
+                    self._remove(key)
+                    self._stats["invalidations"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_table.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, entries=len(self._entries), bytes=self._bytes)
+
+
+query_cache = QueryCache()
+
+
+# second niveau de cache, dans un fichier SQLite local : survit aux
+# redémarrages du processus. Les résultats sont sérialisés avec marshal
+# (compact et rapide pour des listes de tuples de valeurs simples ; un
+# résultat non sérialisable reste seulement en mémoire). Le format marshal
+# change d'une version de Python à l'autre : la version fait partie de la clé,
+# et une valeur illisible (fichier tronqué, ligne corrompue) compte comme un
+# défaut de cache et est supprimée.
+_DISK_FORMAT = (sys.version_info[:2], marshal.version)
+
+
+class DiskCache:
+    def __init__(self, path="query_cache.db", max_bytes=256 * 1024 * 1024,
+                 ttl=3600.0):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode = WAL")
+        self._db.execute("PRAGMA synchronous = NORMAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, "
+                         "value BLOB NOT NULL, expires REAL NOT NULL, "
+                         "size INTEGER NOT NULL, tables TEXT NOT NULL, "
+                         "used REAL NOT NULL)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS cache_used ON cache (used)")
+        self._db.execute("DELETE FROM cache WHERE expires <= ?", (time.time(),))
+        self._db.commit()
+        self._bytes = self._db.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM cache").fetchone()[0]
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    @staticmethod
+    def _digest(key):
+        return hashlib.sha1(repr((_DISK_FORMAT, key)).encode()).hexdigest()
+
+    # rend (True, valeur, secondes restantes) ou (False, None, None)
+    def lookup(self, key):
+        digest = self._digest(key)
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                "SELECT value, expires, size FROM cache WHERE key = ?", (digest,)
+            ).fetchone()
+            if row is None or row[1] <= now:
+                self._stats["misses"] += 1
+                return False, None, None
+            try:
+                value = marshal.loads(row[0])
+            except (ValueError, EOFError, TypeError):
+                self._db.execute("DELETE FROM cache WHERE key = ?", (digest,))
+                self._db.commit()
+                self._bytes -= row[2]
+                self._stats["misses"] += 1
+                return False, None, None
+            self._db.execute("UPDATE cache SET used = ? WHERE key = ?",
+                             (now, digest))
+            self._db.commit()
+            self._stats["hits"] += 1
+        return True, value, row[1] - now
+
+    def put(self, key, value, tables=frozenset(), ttl=None):
+        try:
+            blob = marshal.dumps(value)
+        except ValueError:
+            return
+        if len(blob) > self.max_bytes:
+            return
+        digest = self._digest(key)
+        now = time.time()
+        expires = now + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            old = self._db.execute("SELECT size FROM cache WHERE key = ?",
+                                   (digest,)).fetchone()
+            self._db.execute(
+                "INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?, ?, ?)",
+                (digest, blob, expires, len(blob),
+                 "," + ",".join(sorted(tables)) + ",", now))
+            self._bytes += len(blob) - (old[0] if old else 0)
+            if self._bytes > self.max_bytes:
+                self._evict()
+            self._db.commit()
+
+    # supprime les entrées expirées puis les moins récemment utilisées
+    def _evict(self):
+        self._db.execute("DELETE FROM cache WHERE expires <= ?", (time.time(),))
+        self._bytes = self._db.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM cache").fetchone()[0]
+        rows = self._db.execute("SELECT key, size FROM cache ORDER BY used")
+        victims = []
+        for digest, size in rows:
+            if self._bytes <= self.max_bytes:
+                break
+            victims.append((digest,))
+            self._bytes -= size
+        self._db.executemany("DELETE FROM cache WHERE key = ?", victims)
+        self._stats["evictions"] += len(victims)
+
+    def invalidate(self, *tables):
+        with self._lock:
+            for table in tables:
+                self._db.execute("DELETE FROM cache WHERE tables LIKE ?",
+                                 (f"%,{table.lower()},%",))
+            self._db.commit()
+            self._bytes = self._db.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM cache").fetchone()[0]
+
+    def clear(self):
+        with self._lock:
+            self._db.execute("DELETE FROM cache")
+            self._db.commit()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            entries = self._db.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+            return dict(self._stats, entries=entries, bytes=self._bytes)
+
+    def close(self):
+        self._db.close()
+
+
+# niveau disque partagé par cache_query (désactivé tant qu'on n'appelle pas
+# enable_disk_cache)
+disk_cache = None
+
+
+def enable_disk_cache(path="query_cache.db", **options):
+    global disk_cache
+    if disk_cache is not None:
+        disk_cache.close()
+    disk_cache = DiskCache(path, **options)
+    return disk_cache
+
+
+def disable_disk_cache():
+    global disk_cache
+    if disk_cache is not None:
+        disk_cache.close()
+    disk_cache = None
+
+
+class _Flight:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+# "single-flight" : pour une même clé, une seule exécution à la fois ; les
+# appels qui arrivent pendant ce temps attendent et reçoivent le même
+# résultat (ou la même exception)
+class SingleFlight:
+    def __init__(self):
+        self._flights = {}
+        self._lock = threading.Lock()
+        self.shared = 0
+
+    def do(self, key, fn, timeout=None):
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+            else:
+                self.shared += 1
+        if not leader:
+            if not flight.done.wait(timeout):
+                raise TimeoutError(f"query still running after {timeout}s")
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+        try:
+            flight.result = fn()
+            return flight.result
+        except BaseException as error:
+            flight.error = error
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+
+query_flights = SingleFlight()
+
+
+class _AsyncFlight:
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task):
+        self.task = task
+        self.waiters = 0
+
+
+# même principe pour les coroutines : la requête tourne dans sa propre
+# tâche, que le premier appel et les suivants attendent à travers shield ;
+# l'annulation d'un appel (le premier compris) ne touche pas les autres.
+# Une clé par boucle.
+class AsyncSingleFlight:
+    def __init__(self):
+        self._flights = {}
+        self.shared = 0
+
+    async def do(self, key, fn, timeout=None):
+        loop = asyncio.get_running_loop()
+        key = (id(loop), key)
+        flight = self._flights.get(key)
+        if flight is not None:
+            self.shared += 1
+            flight.waiters += 1
+            try:
+                return await asyncio.wait_for(asyncio.shield(flight.task), timeout)
+            except asyncio.TimeoutError:
+                raise TimeoutError(
+                    f"query still running after {timeout}s") from None
+            finally:
+                flight.waiters -= 1
+
+        flight = self._flights[key] = _AsyncFlight(loop.create_task(fn()))
+        flight.task.add_done_callback(
+            lambda task: self._finished(key, flight))
+        try:
+            return await asyncio.shield(flight.task)
+        except asyncio.CancelledError:
+            # fn() lit la connexion de cet appel : elle n'est rendue qu'une
+            # fois la requête finie ; sans autre appel en attente, la
+            # requête est annulée aussi
+            if not flight.waiters:
+                self._finished(key, flight)
+                flight.task.cancel()
+            await asyncio.wait({flight.task})
+            raise
+
+    def _finished(self, key, flight):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+        task = flight.task
+        if task.done() and not task.cancelled():
+            task.exception()            # lue : pas d'avertissement si personne n'attend
+
+
+async_query_flights = AsyncSingleFlight()
+
+# version de chaque table, augmentée à chaque invalidation : un résultat
+# lu avant une écriture validée pendant la requête n'est pas gardé
+_versions = {}
+_versions_lock = threading.Lock()
+
+
+def _versions_of(tables):
+    return tuple(_versions.get(table, 0) for table in tables)
+
+
+# une écriture validée par @transactional vide les résultats des tables touchées
+def _invalidate(tables):
+    with _versions_lock:
+        for table in tables:
+            _versions[table] = _versions.get(table, 0) + 1
+        query_cache.invalidate(*tables)
+        if disk_cache is not None:
+            disk_cache.invalidate(*tables)
+
+
+# garde le résultat (mémoire, puis disque si tier) seulement si aucune des
+# tables lues n'a été invalidée depuis `versions` ; sous le même verrou que
+# _invalidate, pour qu'une invalidation ne passe pas entre les deux
+def _put_if_current(store, tier, key, result, tables, ttl, versions):
+    if isinstance(result, Iterator):        # flux : lisible une seule fois
+        return
+    with _versions_lock:
+        if _versions_of(tables) != versions:
+            return
+        store.put(key, result, tables, ttl)
+        if tier is not None:
+            tier.put(key, result, tables, ttl)
+
+
+transactional.commit_listeners.append(_invalidate)
+
+
+# noms des paramètres après conn, pour ramener les appels positionnels à des
+# mots-clés (même clé de cache, stream=True reconnu sous les deux formes) ;
+# None si la fonction prend *args ou des paramètres positionnels seulement
+def _parameter_names(func):
+    parameters = list(inspect.signature(func).parameters.values())[1:]
+    if any(p.kind in (p.VAR_POSITIONAL, p.POSITIONAL_ONLY) for p in parameters):
+        return None
+    return tuple(p.name for p in parameters if p.kind is p.POSITIONAL_OR_KEYWORD)
+
+
+def _as_keywords(names, args, kwargs):
+    if not args or names is None or len(args) > len(names):
+        return args, kwargs
+    return (), dict(zip(names, args), **kwargs)
+
+
+def _cache_key(args, kwargs, query_name="query"):
+    rest = dict(kwargs)
+    rest.pop("stream", None)
+    rest.pop("batch_size", None)
+    if query_name in rest:
+        query = rest.pop(query_name)
+    else:
+        query, args = args[0], args[1:]
+    params = tuple(tuple(a) if isinstance(a, list) else a for a in args)
+    return query, (query, params, tuple(sorted(rest.items())))
+
+
+# timeout : attente max (s) d'un appel qui attend l'exécution d'un autre
+# disk : niveau disque à utiliser (par défaut celui d'enable_disk_cache)
+# Sur une coroutine, le niveau disque (sqlite3 bloquant) passe par un thread.
+def cache_query(func=None, *, cache=None, ttl=None, timeout=30.0, disk=None):
+    if func is None:
+        return lambda f: cache_query(f, cache=cache, ttl=ttl, timeout=timeout,
+                                     disk=disk)
+    if inspect.iscoroutinefunction(func):
+        return _async_cache_query(func, cache, ttl, timeout, disk)
+    names = _parameter_names(func)
+    query_name = names[0] if names else "query"
+
+    @functools.wraps(func)
+    def wrapper(conn , *args , **kwargs):
+        # dans un batch() ou un GroupCommit, la connexion voit des écritures
+        # non validées (qui peuvent encore être annulées) : ni lecture ni
+        # écriture du cache
+        if transactional.in_batch(conn):
+            return func(conn, *args, **kwargs)
+        store = cache if cache is not None else query_cache
+        args, kwargs = _as_keywords(names, args, kwargs)
+        query, key = _cache_key(args, kwargs, query_name)
+        try:
+            found, result = store.lookup(key)
+        except TypeError:               # paramètre non hachable : pas de cache
+            return func(conn, *args, **kwargs)
+        if kwargs.get("stream"):
+            # flux : rejoue un résultat déjà en cache, sinon lit la base
+            # sans rien garder
+            return iter(result) if found else func(conn, *args, **kwargs)
+        if found:
+            return result
+
+        def execute():
+            # un autre appel a pu remplir le cache entre-temps
+            found, result = store.lookup(key, count=False)
+            if found:
+                return result
+            tables = tables_of(query)
+            versions = _versions_of(tables)
+            tier = disk if disk is not None else disk_cache
+            if tier is not None:
+                found, result, remaining = tier.lookup(key)
+                if found:
+                    _put_if_current(store, None, key, result, tables,
+                                    min(remaining, ttl or remaining), versions)
+                    return result
+            result = func(conn , *args , **kwargs)
+            _put_if_current(store, tier, key, result, tables, ttl, versions)
+            return result
+        return query_flights.do((id(store), key), execute, timeout)
     return wrapper
 
 
-def cache_query(func):
-        def wrapper(*args , **kwargs):
-            if query query_cache:
-               print("Using cached result")
-               return query_cache[query]
-            print("Executing and caching result")
-            result= func(conn , query, *args , **kwargs)
-            query_cache[query]=result
-            return result 
-        return wrapper
+def _async_cache_query(func, cache, ttl, timeout, disk):
+    names = _parameter_names(func)
+    query_name = names[0] if names else "query"
+
+    @functools.wraps(func)
+    async def wrapper(conn , *args , **kwargs):
+        store = cache if cache is not None else query_cache
+        args, kwargs = _as_keywords(names, args, kwargs)
+        query, key = _cache_key(args, kwargs, query_name)
+        try:
+            found, result = store.lookup(key)
+        except TypeError:
+            return await func(conn, *args, **kwargs)
+        if found:
+            return result
 
+        async def execute():
+            found, result = store.lookup(key, count=False)
+            if found:
+                return result
+            tables = tables_of(query)
+            versions = _versions_of(tables)
+            tier = disk if disk is not None else disk_cache
+            if tier is not None:
+                found, result, remaining = await asyncio.to_thread(tier.lookup, key)
+                if found:
+                    _put_if_current(store, None, key, result, tables,
+                                    min(remaining, ttl or remaining), versions)
+                    return result
+            result = await func(conn , *args , **kwargs)
+            if tier is None:
+                _put_if_current(store, None, key, result, tables, ttl, versions)
+            else:
+                await asyncio.to_thread(_put_if_current, store, tier, key, result,
+                                        tables, ttl, versions)
+            return result
+        return await async_query_flights.do((id(store), key), execute, timeout)
+    return wrapper
 
 
+# stream=True : lignes lues par paquets de batch_size, non mises en cache
 @with_db_connection
 @cache_query
-def fetch_users_with_cache(conn, query):
+@read_only
+def fetch_users_with_cache(conn, query, stream=False, batch_size=1000):
     cursor = conn.cursor()
     cursor.execute(query)
+    if stream:
+        return connections.stream_rows(cursor, batch_size)
     return cursor.fetchall()
 
-#### First call will cache the result
-users = fetch_users_with_cache(query="SELECT * FROM users")
-
-#### Second call will use the cached result
-users_again = fetch_users_with_cache(query="SELECT * FROM users")
+if __name__ == "__main__":
+    #### First call will cache the result
+    users = fetch_users_with_cache(query="SELECT * FROM users")
 
+    #### Second call will use the cached result
+    users_again = fetch_users_with_cache(query="SELECT * FROM users")
+    print(query_cache.stats())
@@ -0,0 +1,397 @@
+#!/usr/bin/env python3
+#Benchmarks hors ligne des décorateurs
+#usage : python3 bench.py [nom_du_benchmark ...] [--save-baseline]
+import asyncio
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import timeit
+import tracemalloc
+
+log_queries = __import__('0-log_queries')
+connections = __import__('1-with_db_connection')
+transactional = __import__('2-transactional')
+retry = __import__('3-retry_on_failure')
+cache_query = __import__('4-cache_query')
+
+
+#base users.db de test : table users(id, name, email, age)
+def make_users_db(path, n=1000):
+    connection = sqlite3.connect(path)
+    connection.execute("CREATE TABLE IF NOT EXISTS users (id INTEGER PRIMARY KEY, "
+                       "name TEXT, email TEXT, age INTEGER)")
+    connection.executemany(
+        "INSERT INTO users (id, name, email, age) VALUES (?, ?, ?, ?)",
+        ((i, f"user {i}", f"user{i}@example.com", 18 + i % 80)
+         for i in range(1, n + 1)))
+    connection.commit()
+    connection.close()
+
+
+#coût d'un appel (µs) : meilleur de `repeat` séries de `number` appels
+def per_call(fn, number=100_000, repeat=5):
+    return min(timeit.repeat(fn, number=number, repeat=repeat)) / number * 1e6
+
+
+#surcoût de log_queries autour d'une fonction qui ne fait rien
+def bench_log_queries():
+    print("log_queries : surcoût par appel")
+
+    def query(query):
+        return [(1,)]
+
+    base = per_call(lambda: query(query="SELECT * FROM users WHERE id = 1"))
+    for label, wrapped in (
+            ("no sink    ", log_queries.log_queries(query)),
+            ("memory sink", log_queries.log_queries(
+                query, sink=log_queries.MemorySink()))):
+        cost = per_call(lambda: wrapped(query="SELECT * FROM users WHERE id = 1"))
+        print(f"  {label}  {cost - base:>6.2f} µs/call")
+
+
+#get_user_by_id : connexion neuve par appel vs pool
+def bench_pool(number=20_000):
+    print("with_db_connection : get_user_by_id")
+    with tempfile.TemporaryDirectory() as tmp:
+        database = os.path.join(tmp, "users.db")
+        make_users_db(database)
+        for label, enabled in (("connect/call", False), ("pooled      ", True)):
+            connections.configure_pool(enabled=enabled, database=database)
+            cost = per_call(lambda: connections.get_user_by_id(user_id=42),
+                            number=number, repeat=3)
+            print(f"  {label}  {1e6 / cost:>10.0f} calls/s")
+        connections.configure_pool()
+
+
+#recherches par clé répétées : sans cache de requêtes préparées (chaque
+#appel analyse le SQL) vs avec
+def bench_statements(number=50_000):
+    print("with_db_connection : get_user_by_id, cache de requêtes préparées")
+    with tempfile.TemporaryDirectory() as tmp:
+        database = os.path.join(tmp, "users.db")
+        make_users_db(database)
+        for label, size in (("no cache ", 0), ("cache 128", 128)):
+            connections.configure_pool(database=database, statement_cache=size)
+            cost = per_call(lambda: connections.get_user_by_id(user_id=42),
+                            number=number, repeat=3)
+            stats = connections.get_pool().statement_stats()
+            print(f"  {label}  {cost:>6.2f} µs/call  hits {stats['hits']}"
+                  f"  misses {stats['misses']}")
+        connections.configure_pool()
+
+
+#update_user_email sur une base WAL : un commit par appel, tous les appels
+#dans batch(), puis GroupCommit avec plusieurs threads écrivains (nowait :
+#sans attendre le commit, au risque de perdre le dernier groupe)
+def bench_group_commit(number=2000, threads=64):
+    print(f"transactional : {number} update_user_email, base WAL")
+    with tempfile.TemporaryDirectory() as tmp:
+        database = os.path.join(tmp, "users.db")
+        make_users_db(database)
+        connections.configure_pool(database=database,
+                                   pragmas=dict(connections.PRAGMAS,
+                                                synchronous="FULL"))
+
+        def updates(ids):
+            for i in ids:
+                transactional.update_user_email(user_id=i % 1000 + 1,
+                                                new_email=f"u{i}@example.com")
+
+        def per_call():
+            updates(range(number))
+
+        def batched():
+            with transactional.batch():
+                updates(range(number))
+
+        def grouped(wait=True):
+            with transactional.GroupCommit(every=threads, interval=0.005,
+                                           wait=wait):
+                workers = [threading.Thread(target=updates,
+                                            args=(range(t, number, threads),))
+                           for t in range(threads)]
+                for thread in workers:
+                    thread.start()
+                for thread in workers:
+                    thread.join()
+
+        for label, run in (("per call    ", per_call), ("batch()     ", batched),
+                           (f"group x{threads:<4}", grouped),
+                           ("group nowait", lambda: grouped(wait=False))):
+            start = time.perf_counter()
+            run()
+            elapsed = time.perf_counter() - start
+            print(f"  {label}  {number / elapsed:>10.0f} updates/s")
+        connections.configure_pool()
+
+
+#lectures get_user_by_id pendant que des écrivains gardent leurs connexions
+#(transactions longues dans batch()) : pool principal seul, où lecteurs et
+#écrivains se disputent les connexions, vs répliques en lecture seule sur la
+#même base WAL
+def bench_replicas(readers=4, writers=4, seconds=2.0):
+    print(f"with_db_connection : {readers} lecteurs, {writers} écrivains")
+    with tempfile.TemporaryDirectory() as tmp:
+        database = os.path.join(tmp, "users.db")
+        make_users_db(database)
+        connections.open_connection(database).close()      # passe en WAL
+        for label, replicas in (("primary only", ()),
+                                ("2 replicas  ", (database, database))):
+            connections.configure_pool(database=database, max_size=writers,
+                                       replicas=replicas,
+                                       strategy="least_loaded")
+            stop = time.perf_counter() + seconds
+            latencies = []
+            batches = []
+
+            def read():
+                while time.perf_counter() < stop:
+                    start = time.perf_counter()
+                    connections.get_user_by_id(user_id=42)
+                    latencies.append(time.perf_counter() - start)
+
+            def write():
+                while time.perf_counter() < stop:
+                    with transactional.batch():
+                        for i in range(20):
+                            transactional.update_user_email(
+                                user_id=i + 1, new_email=f"w{i}@example.com")
+                        time.sleep(0.02)        # travail dans la transaction
+                    batches.append(1)
+
+            workers = ([threading.Thread(target=read) for _ in range(readers)]
+                       + [threading.Thread(target=write) for _ in range(writers)])
+            for thread in workers:
+                thread.start()
+            for thread in workers:
+                thread.join()
+            latencies.sort()
+            p99 = latencies[int(len(latencies) * 0.99)] * 1000
+            print(f"  {label}  {len(latencies) / seconds:>8.0f} reads/s"
+                  f"  p99 {p99:>7.2f} ms  {len(batches) / seconds:>5.1f}"
+                  f" write batches/s")
+        connections.configure_pool()
+
+
+#retard maximal de la boucle asyncio (une tâche qui dort 1 ms et mesure son
+#réveil) pendant des requêtes lentes : pile synchrone appelée depuis une
+#coroutine (bloque la boucle) vs la même pile en version async
+def bench_loop_lag(calls=40, n=200_000):
+    print(f"boucle asyncio : retard max pendant {calls} requêtes lentes")
+    slow = "SELECT COUNT(*) FROM users WHERE email LIKE ? AND age > ?"
+
+    @connections.with_db_connection
+    @retry.retry_on_failure(retries=3, delay=0.01)
+    @cache_query.cache_query(cache=cache_query.QueryCache(ttl=0))
+    @log_queries.log_queries
+    def sync_count(conn, query, age):
+        return conn.execute(query, ("%9%", age)).fetchall()
+
+    @connections.with_db_connection
+    @retry.retry_on_failure(retries=3, delay=0.01)
+    @cache_query.cache_query(cache=cache_query.QueryCache(ttl=0))
+    @log_queries.log_queries
+    async def async_count(conn, query, age):
+        async with conn.execute(query, ("%9%", age)) as cursor:
+            return await cursor.fetchall()
+
+    async def measure(run):
+        lags = []
+        done = False
+
+        async def ticker():
+            while not done:
+                start = time.perf_counter()
+                await asyncio.sleep(0.001)
+                lags.append(time.perf_counter() - start - 0.001)
+
+        tick = asyncio.create_task(ticker())
+        await asyncio.sleep(0.01)
+        start = time.perf_counter()
+        await run()
+        elapsed = time.perf_counter() - start
+        done = True
+        await tick
+        return elapsed, max(lags)
+
+    async def blocking():
+        for age in range(calls):
+            sync_count(query=slow, age=age)
+
+    async def non_blocking():
+        await asyncio.gather(*(async_count(query=slow, age=age)
+                               for age in range(calls)))
+
+    async def main():
+        for label, run in (("sync stack ", blocking), ("async stack", non_blocking)):
+            elapsed, lag = await measure(run)
+            print(f"  {label}  {elapsed:>6.2f} s  max lag {lag * 1000:>8.1f} ms")
+        await connections.close_async_pool()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database = os.path.join(tmp, "users.db")
+        make_users_db(database, n)
+        connections.configure_pool(database=database)
+        asyncio.run(main())
+        connections.configure_pool()
+
+
+#lecture de toute la table : fetchall vs stream=True (fetchmany), pic
+#mémoire (tracemalloc) et durée
+def bench_stream(n=200_000, batch_size=1000):
+    print(f"fetch_users_with_retry : {n} lignes")
+    with tempfile.TemporaryDirectory() as tmp:
+        database = os.path.join(tmp, "users.db")
+        make_users_db(database, n)
+        connections.configure_pool(database=database)
+        for label, read in (
+                ("fetchall   ", lambda: len(retry.fetch_users_with_retry())),
+                ("stream 1000", lambda: sum(1 for _ in retry.fetch_users_with_retry(
+                    stream=True, batch_size=batch_size)))):
+            tracemalloc.start()
+            start = time.perf_counter()
+            rows = read()
+            elapsed = time.perf_counter() - start
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            print(f"  {label}  {rows} rows  {elapsed:>6.2f} s"
+                  f"  peak {peak / 1e6:>7.1f} Mo")
+        connections.configure_pool()
+
+
+#référence de bench_overhead (python3 bench.py overhead --save-baseline)
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        "bench_baseline.json")
+SAVE_BASELINE = False
+
+
+#octets alloués au pic pendant un appel (moyenne), et blocs gardés après
+#les appels (fuite éventuelle)
+def allocations(fn, number=2000):
+    fn()
+    tracemalloc.start()
+    try:
+        peak = 0
+        for _ in range(number):
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            fn()
+            peak += tracemalloc.get_traced_memory()[1] - before
+    finally:
+        tracemalloc.stop()
+    blocks = sys.getallocatedblocks()
+    for _ in range(number):
+        fn()
+    return peak / number, (sys.getallocatedblocks() - blocks) / number
+
+
+#surcoût de chaque décorateur, seul puis dans les piles courantes, autour
+#d'une recherche par clé sur une base SQLite en mémoire. Le coût est aussi
+#rapporté à celui de l'appel nu : c'est ce rapport, moins sensible à la
+#machine, qui est comparé à bench_baseline.json (régression au-delà de
+#`tolerance`).
+def bench_overhead(number=5000, rounds=15, tolerance=0.25):
+    print("surcoût des décorateurs (base SQLite en mémoire)")
+    database = "file:bench_overhead?mode=memory&cache=shared"
+    keeper = connections.open_connection(database, {})
+    keeper.execute("CREATE TABLE IF NOT EXISTS users (id INTEGER PRIMARY KEY, "
+                   "name TEXT, email TEXT, age INTEGER)")
+    keeper.executemany("INSERT OR REPLACE INTO users VALUES (?, ?, ?, ?)",
+                       ((i, f"user {i}", f"user{i}@example.com", 18 + i % 80)
+                        for i in range(1, 1001)))
+    keeper.commit()
+    connections.configure_pool(database=database, pragmas={})
+    query = "SELECT * FROM users WHERE id = 42"
+
+    def get_user(conn, query):
+        return conn.execute(query).fetchone()
+
+    def stack(*decorators, connected=True):
+        func = get_user
+        for decorator in reversed(decorators):
+            func = decorator(func)
+        if connected:
+            return lambda: func(query=query)
+        return lambda: func(keeper, query=query)
+
+    log = log_queries.log_queries
+    retry_ = retry.retry_on_failure(retries=3, delay=0.01)
+    cache = lambda func: cache_query.cache_query(func, cache=cache_query.QueryCache())
+    tx = transactional.transactional
+    db = connections.with_db_connection
+    cases = {
+        "bare": stack(connected=False),
+        "log_queries": stack(log, connected=False),
+        "retry_on_failure": stack(retry_, connected=False),
+        "transactional": stack(tx, connected=False),
+        "cache_query (hit)": stack(cache, connected=False),
+        "with_db_connection": stack(db),
+        "db+log": stack(db, log),
+        "db+retry": stack(db, retry_),
+        "db+retry+tx+log": stack(db, retry_, tx, log),
+        "db+retry+cache+log": stack(db, retry_, cache, log),
+    }
+
+    baseline = {}
+    if os.path.exists(BASELINE) and not SAVE_BASELINE:
+        with open(BASELINE, encoding="utf-8") as file:
+            baseline = json.load(file)
+    # séries entrelacées (tous les cas à chaque tour, meilleur tour gardé)
+    # pour que les variations de la machine touchent tous les cas pareil
+    costs = dict.fromkeys(cases, float("inf"))
+    for _ in range(rounds):
+        for name, fn in cases.items():
+            costs[name] = min(costs[name], timeit.timeit(fn, number=number))
+    bare = costs["bare"]
+    results = {}
+    regressions = []
+    for name, fn in cases.items():
+        cost = costs[name] / number * 1e6
+        ratio = costs[name] / bare
+        peak, kept = allocations(fn)
+        results[name] = {"us": round(cost, 3), "ratio": round(ratio, 3),
+                         "peak_bytes": round(peak)}
+        line = (f"  {name:<20} {cost:>7.2f} µs  x{ratio:>5.2f}"
+                f"  {peak:>7.0f} B peak  {round(kept, 2) or 0.0:>5.2f} blocks kept")
+        reference = baseline.get(name)
+        if reference is not None:
+            limit = reference["ratio"] * (1 + tolerance)
+            if ratio > limit:
+                regressions.append(name)
+                line += f"  REGRESSION (baseline x{reference['ratio']:.2f})"
+        print(line)
+
+    connections.configure_pool()
+    keeper.close()
+    if SAVE_BASELINE:
+        with open(BASELINE, "w", encoding="utf-8") as file:
+            json.dump(results, file, indent=2)
+            file.write("\n")
+        print(f"  baseline saved to {os.path.basename(BASELINE)}")
+    elif not baseline:
+        print("  no baseline (python3 bench.py overhead --save-baseline)")
+    if regressions:
+        raise SystemExit(f"regressions: {', '.join(regressions)}")
+
+
+BENCHMARKS = {
+    "log_queries": bench_log_queries,
+    "pool": bench_pool,
+    "statements": bench_statements,
+    "group_commit": bench_group_commit,
+    "replicas": bench_replicas,
+    "loop_lag": bench_loop_lag,
+    "overhead": bench_overhead,
+    "stream": bench_stream,
+}
+
+
+if __name__ == "__main__":
+    SAVE_BASELINE = "--save-baseline" in sys.argv
+    names = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    for name in names or BENCHMARKS:
+        BENCHMARKS[name]()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""Tests that the async decorator stack does not block the event loop.
+"""
+import asyncio
+import os
+import sqlite3
+import tempfile
+import time
+import unittest
+
+log_queries = __import__('0-log_queries')
+connections = __import__('1-with_db_connection')
+retry = __import__('3-retry_on_failure')
+cache_query = __import__('4-cache_query')
+
+SLOW = "SELECT COUNT(*) FROM users WHERE email LIKE ? AND age > ?"
+MAX_LAG = 0.05
+
+
+async def max_lag(run):
+    """Runs the coroutine function `run` and returns the largest delay
+    seen by a task waking up every millisecond meanwhile.
+    """
+    lags = []
+    done = False
+
+    async def ticker():
+        while not done:
+            start = time.perf_counter()
+            await asyncio.sleep(0.001)
+            lags.append(time.perf_counter() - start - 0.001)
+
+    tick = asyncio.create_task(ticker())
+    await asyncio.sleep(0.01)
+    await run()
+    done = True
+    await tick
+    return max(lags)
+
+
+class TestEventLoop(unittest.TestCase):
+    """Slow queries through with_db_connection, retry_on_failure,
+    cache_query and log_queries, all async.
+    """
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        database = os.path.join(self.tmp.name, "users.db")
+        connection = sqlite3.connect(database)
+        connection.execute("CREATE TABLE users (id INTEGER PRIMARY KEY, "
+                           "name TEXT, email TEXT, age INTEGER)")
+        connection.executemany(
+            "INSERT INTO users VALUES (?, ?, ?, ?)",
+            ((i, f"user {i}", f"user{i}@example.com", 18 + i % 60)
+             for i in range(1, 100_001)))
+        connection.commit()
+        connection.close()
+        connections.configure_pool(database=database)
+
+    def tearDown(self):
+        connections.configure_pool()
+        self.tmp.cleanup()
+
+    def test_probe_sees_blocking_call(self):
+        """A blocking call inside a coroutine shows up as loop lag"""
+        async def blocking():
+            time.sleep(0.2)
+
+        self.assertGreater(asyncio.run(max_lag(blocking)), MAX_LAG)
+
+    def test_async_stack_does_not_block(self):
+        """Concurrent slow queries leave the loop responsive"""
+        @connections.with_db_connection
+        @retry.retry_on_failure(retries=3, delay=0.01)
+        @cache_query.cache_query(cache=cache_query.QueryCache(ttl=0))
+        @log_queries.log_queries
+        async def count(conn, query, age):
+            async with conn.execute(query, ("%9%", age)) as cursor:
+                return await cursor.fetchall()
+
+        async def queries():
+            results = await asyncio.gather(*(count(query=SLOW, age=age)
+                                             for age in range(20)))
+            self.assertEqual(len(results), 20)
+
+        async def main():
+            try:
+                return await max_lag(queries)
+            finally:
+                await connections.close_async_pool()
+
+        self.assertLess(asyncio.run(main()), MAX_LAG)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""Tests for the single-flight behaviour of cache_query.
+"""
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import unittest
+
+connections = __import__('1-with_db_connection')
+cache_query = __import__('4-cache_query')
+
+QUERY = "SELECT id, email FROM users WHERE id <= 3"
+THREADS = 64
+
+
+def run_concurrently(fn, threads):
+    """Calls fn from `threads` threads released together, returns the
+    results and exceptions in a single list.
+    """
+    barrier = threading.Barrier(threads)
+    outcomes = []
+    lock = threading.Lock()
+
+    def worker():
+        barrier.wait()
+        try:
+            outcome = fn()
+        except Exception as error:
+            outcome = error
+        with lock:
+            outcomes.append(outcome)
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return outcomes
+
+
+class TestSingleFlight(unittest.TestCase):
+    """Concurrent callers of a cold key through with_db_connection and
+    cache_query.
+    """
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        database = os.path.join(self.tmp.name, "users.db")
+        connection = sqlite3.connect(database)
+        connection.execute("CREATE TABLE users (id INTEGER PRIMARY KEY, "
+                           "name TEXT, email TEXT, age INTEGER)")
+        connection.executemany(
+            "INSERT INTO users VALUES (?, ?, ?, ?)",
+            [(i, f"user {i}", f"user{i}@example.com", 20 + i)
+             for i in range(1, 11)])
+        connection.commit()
+        connection.close()
+        # une connexion par appelant : aucun n'attend le pool pendant le vol
+        connections.configure_pool(database=database, max_size=THREADS)
+        self.cache = cache_query.QueryCache()
+        self.executions = 0
+
+    def tearDown(self):
+        connections.configure_pool()
+        self.tmp.cleanup()
+
+    def cached(self, delay=0.05, error=None, timeout=30.0):
+        """Builds a decorated query that counts its executions."""
+        @connections.with_db_connection
+        @cache_query.cache_query(cache=self.cache, timeout=timeout)
+        def fetch(conn, query):
+            self.executions += 1
+            time.sleep(delay)
+            if error is not None:
+                raise error
+            return conn.execute(query).fetchall()
+        return fetch
+
+    def test_one_execution_for_concurrent_callers(self):
+        """Concurrent callers of a cold key run the query once, all get
+        its rows
+        """
+        fetch = self.cached()
+        outcomes = run_concurrently(lambda: fetch(query=QUERY), THREADS)
+
+        expected = [(1, "user1@example.com"), (2, "user2@example.com"),
+                    (3, "user3@example.com")]
+        self.assertEqual(self.executions, 1)
+        self.assertEqual(outcomes, [expected] * THREADS)
+        self.assertEqual(fetch(query=QUERY), expected)
+        self.assertEqual(self.executions, 1)
+
+    def test_error_reaches_every_waiter(self):
+        """The leader's exception is raised in all callers and not cached"""
+        # une erreur n'est pas mise en cache : le leader doit durer assez
+        # longtemps pour que tous les appelants rejoignent son vol
+        fetch = self.cached(delay=0.2, error=sqlite3.OperationalError("boom"))
+        outcomes = run_concurrently(lambda: fetch(query=QUERY), THREADS)
+
+        self.assertEqual(self.executions, 1)
+        self.assertEqual(len(outcomes), THREADS)
+        for outcome in outcomes:
+            self.assertIsInstance(outcome, sqlite3.OperationalError)
+            self.assertEqual(str(outcome), "boom")
+        _, key = cache_query._cache_key((), {"query": QUERY})
+        self.assertNotIn(key, self.cache)
+        with self.assertRaises(sqlite3.OperationalError):
+            fetch(query=QUERY)
+        self.assertEqual(self.executions, 2)
+
+    def test_follower_timeout(self):
+        """A follower gives up after `timeout`, the leader still finishes"""
+        fetch = self.cached(delay=0.5, timeout=0.05)
+        results = {}
+
+        def leader():
+            results["leader"] = fetch(query=QUERY)
+
+        thread = threading.Thread(target=leader)
+        thread.start()
+        time.sleep(0.1)
+        with self.assertRaises(TimeoutError):
+            fetch(query=QUERY)
+        thread.join()
+
+        self.assertEqual(self.executions, 1)
+        self.assertEqual(len(results["leader"]), 3)
+        self.assertEqual(fetch(query=QUERY), results["leader"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,17 +1,39 @@
-import mysql.connector
+import seed
+from rows import User
 
-def stream_users():
-    connection = mysql.connector.connect(
-        host="localhost",
-        user="root",
-        password="password",
-        database="ALX_prodev"
-    )
-   cursor=connection.cursor(dictionary=True)
-   cursor.execute("SELECT * FROM user_data")
+#unbuffered=True : curseur côté serveur, lignes en tuples lues par fenêtres
+#de `prefetch` lignes → la mémoire reste constante quelle que soit la table
+#compact=True : chaque ligne est un rows.User (__slots__) au lieu d'un dict
+def stream_users(unbuffered=False, prefetch=1000, connection=None, compact=False):
+    own_connection = connection is None
+    if own_connection:
+        connection = seed.connect_to_prodev()
 
-   for row in cursor:
-       yield row
-
-   cursor.close()
-   connection.close()
+    if unbuffered:
+        cursor = seed.stream_cursor(connection)
+    elif compact:
+        cursor = connection.cursor()
+    else:
+        cursor = seed.dict_cursor(connection)
+    try:
+        cursor.execute(User.SELECT if compact else "SELECT * FROM user_data")
+        if unbuffered:
+            while True:
+                rows = cursor.fetchmany(prefetch)
+                if not rows:
+                    break
+                if compact:
+                    yield from map(User.from_row, rows)
+                else:
+                    yield from rows
+        else:
+            for row in cursor:
+                yield User.from_row(row) if compact else row
+    finally:
+        # générateur fermé avant la fin : MySQL refuse de fermer un curseur
+        # non bufferisé tant qu'il reste des lignes non lues
+        if unbuffered and not seed.is_sqlite(connection):
+            connection.consume_results()
+        cursor.close()
+        if own_connection:
+            connection.close()
@@ -1,24 +1,158 @@
-import mysql.connector
-
-def stream_users_in_batches(batch_size):
-    connection = mysql.connector.connect(
-        host="localhost",
-        user="root",
-        password="password",
-        database="ALX_prodev"
-    )
-    cursor=connection.cursor(dictionary=True)
- 
-    cursor.execute("SELECT * FROM user_data")
-
-    while True:
-          batch= cursor.fetchmany(batch_size)
-          if not batch: break
-          yield batch
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
+import columns
+import seed
+from rows import User
+
+_DONE = object()
+
+
+#compact=True : paquets de rows.User au lieu de dicts
+def stream_users_in_batches(batch_size, workers=1, ordered=False, connect=None,
+                            queue_size=8, compact=False):
+    connect = connect or seed.connect_to_prodev
+    if workers > 1:
+        yield from _parallel_batches(batch_size, workers, ordered, connect,
+                                     queue_size, compact)
+        return
+
+    connection = connect()
+    cursor = connection.cursor() if compact else seed.dict_cursor(connection)
+
+    try:
+        cursor.execute(User.SELECT if compact else "SELECT * FROM user_data")
+        while True:
+              batch= cursor.fetchmany(batch_size)
+              if not batch: break
+              yield [User.from_row(row) for row in batch] if compact else batch
+    finally:
+        cursor.close()
+        connection.close()
+
+
+#bornes des partitions : `parts` plages de user_id de même taille
+#[(None, b1), (b1, b2), ..., (bn, None)]
+def partition_bounds(connection, parts):
+    cursor = connection.cursor()
+    cursor.execute("SELECT COUNT(*) FROM user_data")
+    total = cursor.fetchone()[0]
+    bounds = []
+    for k in range(1, parts):
+        cursor.execute("SELECT user_id FROM user_data ORDER BY user_id "
+                       f"LIMIT 1 OFFSET {total * k // parts}")
+        row = cursor.fetchone()
+        if row and (not bounds or row[0] != bounds[-1]):
+            bounds.append(row[0])
     cursor.close()
-    connection.close()
+    return list(zip([None] + bounds, bounds + [None]))
+
+
+#put bloquant qui abandonne si le consommateur a arrêté de lire
+def _put(out, item, stop):
+    while not stop.is_set():
+        try:
+            out.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+#lecture d'une plage [low, high) sur sa propre connexion
+def _scan_partition(connect, low, high, batch_size, out, stop, compact=False):
+    try:
+        connection = connect()
+        try:
+            p = seed.placeholder(connection)
+            conditions, params = [], []
+            if low is not None:
+                conditions.append(f"user_id >= {p}")
+                params.append(low)
+            if high is not None:
+                conditions.append(f"user_id < {p}")
+                params.append(high)
+            where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
 
+            if compact:
+                cursor = connection.cursor()
+                select = User.SELECT
+            else:
+                cursor = seed.dict_cursor(connection)
+                select = "SELECT * FROM user_data"
+            cursor.execute(f"{select}{where} ORDER BY user_id", params)
+            while not stop.is_set():
+                batch = cursor.fetchmany(batch_size)
+                if compact:
+                    batch = [User.from_row(row) for row in batch]
+                if not batch or not _put(out, batch, stop):
+                    break
+            cursor.close()
+        finally:
+            connection.close()
+    except Exception as error:
+        _put(out, error, stop)
+    _put(out, _DONE, stop)
+
+
+#les partitions sont lues en parallèle et les paquets passent par une file
+#bornée (backpressure) ; ordered=True rend les paquets dans l'ordre des
+#partitions, sinon dans l'ordre d'arrivée
+def _parallel_batches(batch_size, workers, ordered, connect, queue_size,
+                      compact=False):
+    connection = connect()
+    try:
+        ranges = partition_bounds(connection, workers)
+    finally:
+        connection.close()
+
+    stop = threading.Event()
+    if ordered:
+        queues = [queue.Queue(max(1, queue_size // len(ranges))) for _ in ranges]
+    else:
+        queues = [queue.Queue(queue_size)] * len(ranges)
+
+    pool = ThreadPoolExecutor(max_workers=len(ranges))
+    try:
+        for (low, high), out in zip(ranges, queues):
+            pool.submit(_scan_partition, connect, low, high, batch_size, out,
+                        stop, compact)
+
+        remaining = len(ranges)
+        current = 0
+        while remaining:
+            item = queues[current].get()
+            if item is _DONE:
+                remaining -= 1
+                if ordered:
+                    current += 1
+                continue
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
+        pool.shutdown(wait=True)
+
+
+
+#paquets au format colonnes (voir columns.py) : lignes lues en tuples
+def stream_users_in_columns(batch_size, connect=None):
+    connection = (connect or seed.connect_to_prodev)()
+    cursor = seed.stream_cursor(connection)
+    try:
+        cursor.execute("SELECT user_id, name, email, age FROM user_data")
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield columns.to_columns(rows)
+    finally:
+        if not seed.is_sqlite(connection):
+            connection.consume_results()
+        cursor.close()
+        connection.close()
 
 
 #Fonction batch_processing(batch_size)
@@ -27,16 +161,19 @@ def stream_users_in_batches(batch_size):
 
 #Pour chaque batch reçu :
 
-#Parcourt les utilisateurs
-
 #Filtre ceux dont age > 25
 
-#Les affiche un par un
-
+#Rend les paquets filtrés un par un (liste de dicts, ou dict de colonnes
+#filtré d'un coup quand columnar=True)
 
+def batch_processing(batch_size, columnar=False, connect=None):
+    if columnar:
+        yield from columns.filter_batches(
+            stream_users_in_columns(batch_size, connect),
+            columns.where("age", ">", 25))
+        return
 
-def batch_processing(batch_size):
-    for batch in stream_users_in_batches(batch_size):
-        for user in batch
-            if (user['age'] > 25 :
-               return user
+    for batch in stream_users_in_batches(batch_size, connect=connect):
+        users = [user for user in batch if user['age'] > 25]
+        if users:
+            yield users
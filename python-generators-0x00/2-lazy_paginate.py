@@ -1,22 +1,70 @@
 import seed
 
-def paginate_users(page_size, offset):
-    connection = seed.connect_to_prodev()        # 1. Connexion à la base 'ALX_prodev'
-    cursor = connection.cursor(dictionary=True)  # 2. Crée un curseur qui retourne les lignes comme des dictionnaires
-    cursor.execute("SELECT * FROM user_data LIMIT {page_size} OFFSET {offset}"
-                  )                              # 3. Fait une requête SQL pour obtenir une page d'utilisateurs
-    
-    rows = cursor.fetchall()                     # 4. Récupère toutes les lignes de cette page
+def paginate_users(page_size, offset, connection=None):
+    own_connection = connection is None
+    if own_connection:
+        connection = seed.connect_to_prodev()    # 1. Connexion à la base 'ALX_prodev'
+    try:
+        cursor = seed.dict_cursor(connection)    # 2. Crée un curseur qui retourne les lignes comme des dictionnaires
+        try:
+            cursor.execute(f"SELECT * FROM user_data LIMIT {int(page_size)} OFFSET {int(offset)}"
+                          )                      # 3. Fait une requête SQL pour obtenir une page d'utilisateurs
+            rows = cursor.fetchall()             # 4. Récupère toutes les lignes de cette page
+        finally:
+            cursor.close()
+    finally:
+        if own_connection:
+            connection.close()                   # 6. Ferme la connexion
+    return rows
+
+
+#pagination par clé (keyset) : on se place directement après le dernier
+#user_id vu grâce à l'index de la clé primaire, au lieu de relire et jeter
+#`offset` lignes à chaque page
+def paginate_users_after(connection, page_size, after=None):
+    p = seed.placeholder(connection)
+    cursor = seed.dict_cursor(connection)
+    if after is None:
+        cursor.execute(f"SELECT * FROM user_data ORDER BY user_id LIMIT {p}",
+                       (page_size,))
+    else:
+        cursor.execute(
+            f"SELECT * FROM user_data WHERE user_id > {p} ORDER BY user_id LIMIT {p}",
+            (after, page_size))
+    rows = cursor.fetchall()
     cursor.close()
-    connection.close()                           # 6. Ferme la connexion
-    return rows 
+    return rows
+
+
+#jeton de reprise : le user_id de la dernière ligne de la page
+def page_token(page):
+    return page[-1]['user_id']
+
+
+#une seule connexion pour tout le parcours ; `after` = jeton d'une page déjà
+#traitée pour reprendre un job interrompu au milieu de la table
+def lazy_paginate(page_size, after=None, connection=None):
+    own_connection = connection is None
+    if own_connection:
+        connection = seed.connect_to_prodev()
+    try:
+        while True:
+            page = paginate_users_after(connection, page_size, after)
+            if not page:
+                break
+            yield page
+            after = page_token(page)
+    finally:
+        if own_connection:
+            connection.close()
 
 
-def lazy_paginate(page_size):
+#ancienne version LIMIT/OFFSET, gardée pour comparaison
+def lazy_paginate_offset(page_size, connection=None):
     offset = 0                      # 1. On commence à lire à partir du début de la base
     while True:
-          page = paginate_users(page_size , offset)    # 3. On récupère une page d'utilisateurs 
+          page = paginate_users(page_size , offset, connection)    # 3. On récupère une page d'utilisateurs
           if not page:
              break                  # 4. Si la page est vide → fin de la base → on quitte
           yield page                # 5. On retourne la page actuelle au fur et à mesure (lazy)
-          offst += page_size        # 6. On avance à la prochaine page
+          offset += page_size       # 6. On avance à la prochaine page
@@ -1,29 +1,63 @@
-import seed 
+import seed
+from stats import RunningStats
 
 #Utiliser un générateur qui lit âge par âge
 
-def stream_user_ages():
-    connection=seed.connect_to_prodev()
-    cursor=connection.cursor()
-    cursor.execute("SELECT age FROM user_data")
+def stream_user_ages(connection=None):
+    own_connection = connection is None
+    if own_connection:
+        connection = seed.connect_to_prodev()
+    cursor = connection.cursor()
+    try:
+        cursor.execute("SELECT age FROM user_data")
+        for (age,) in cursor:
+            yield float(age)
+    finally:
+        cursor.close()
+        if own_connection:
+            connection.close()
 
-    for age in cursor:
-        yield age
 
-    cursor.close()
-    connection.close()
+#Agrégats calculés directement par la base : seule une ligne traverse le réseau
+def sql_age_stats(connection=None, bucket=None):
+    own_connection = connection is None
+    if own_connection:
+        connection = seed.connect_to_prodev()
+    cursor = connection.cursor()
+    try:
+        cursor.execute(
+            "SELECT COUNT(age), SUM(age), MIN(age), MAX(age), AVG(age) FROM user_data")
+        count, total, low, high, avg = cursor.fetchone()
+        result = {"count": count, "sum": total, "min": low, "max": high,
+                  "avg": float(avg) if avg is not None else None}
+
+        # histogramme groupé par tranches de `bucket` ans
+        if bucket:
+            p = seed.placeholder(connection)
+            cursor.execute(
+                f"SELECT age - age % {p} AS bucket, COUNT(*) FROM user_data "
+                "GROUP BY bucket ORDER BY bucket", (bucket,))
+            result["histogram"] = {int(b): n for b, n in cursor.fetchall()}
+        return result
+    finally:
+        cursor.close()
+        if own_connection:
+            connection.close()
+
+
+#Statistiques en un seul passage sur un générateur d'âges (moyenne, écart
+#type, percentiles) quand l'agrégat ne peut pas être fait en SQL
+def stream_age_stats(ages=None, sample_size=1024):
+    if ages is None:
+        ages = stream_user_ages()
+    return RunningStats(sample_size).update(ages)
 
 
 #Calculer la moyenne
-def average_age():
-    total = 0
-    count =0
-    for age in stream_user_ages():
-        total+= age
-        count+=1
-
-    if count >0
-       avg =total / count
-       print("Average age of users: {avg:.2f}")
+def average_age(connection=None):
+    avg = sql_age_stats(connection)["avg"]
+
+    if avg is not None:
+       print(f"Average age of users: {avg:.2f}")
     else:
       print("No users found!!")
@@ -0,0 +1,119 @@
+import asyncio
+import contextlib
+import inspect
+
+#Versions asynchrones des générateurs : `async for row in astream_users()`.
+#Pendant que l'appelant traite un paquet, le suivant est déjà demandé à la
+#base, ce qui superpose I/O et traitement.
+
+
+#connexion aiosqlite si `path` est donné (tests, hors ligne), sinon aiomysql
+#sur ALX_prodev
+async def aconnect(path=None):
+    if path is not None:
+        import aiosqlite
+        return await aiosqlite.connect(path)
+    import aiomysql
+    return await aiomysql.connect(host="localhost", user="root",
+                                  password="password", db="ALX_prodev")
+
+
+def _is_sqlite(connection):
+    return type(connection).__module__.startswith("aiosqlite")
+
+
+def _placeholder(connection):
+    return "?" if _is_sqlite(connection) else "%s"
+
+
+async def _close(resource):
+    result = resource.close()       # aiomysql : close() est synchrone
+    if inspect.isawaitable(result):
+        await result
+
+
+#curseur côté serveur avec aiomysql (SSCursor), curseur normal avec aiosqlite
+async def _cursor(connection):
+    if _is_sqlite(connection):
+        return await connection.cursor()
+    import aiomysql
+    return await connection.cursor(aiomysql.SSCursor)
+
+
+#rend les paquets de fetch() en demandant toujours le suivant à l'avance ;
+#un paquet vide marque la fin
+async def _prefetched(fetch):
+    task = asyncio.ensure_future(fetch())
+    try:
+        while True:
+            batch = await task
+            if not batch:
+                return
+            task = asyncio.ensure_future(fetch(batch))
+            yield batch
+    finally:
+        if not task.done():
+            task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await task
+
+
+def _as_dicts(cursor, rows):
+    columns = [col[0] for col in cursor.description]
+    return [dict(zip(columns, row)) for row in rows]
+
+
+async def astream_users_in_batches(batch_size, connection=None):
+    own_connection = connection is None
+    if own_connection:
+        connection = await aconnect()
+    cursor = await _cursor(connection)
+    try:
+        await cursor.execute("SELECT * FROM user_data")
+
+        async def fetch(previous=None):
+            return _as_dicts(cursor, await cursor.fetchmany(batch_size))
+
+        async for batch in _prefetched(fetch):
+            yield batch
+    finally:
+        await _close(cursor)
+        if own_connection:
+            await _close(connection)
+
+
+async def astream_users(batch_size=1000, connection=None):
+    async for batch in astream_users_in_batches(batch_size, connection):
+        for row in batch:
+            yield row
+
+
+#pagination par clé comme lazy_paginate : la page suivante est demandée dès
+#que le user_id de fin de la page courante est connu
+async def alazy_paginate(page_size, after=None, connection=None):
+    own_connection = connection is None
+    if own_connection:
+        connection = await aconnect()
+    p = _placeholder(connection)
+    try:
+        async def fetch(previous=None):
+            last = previous[-1]["user_id"] if previous else after
+            cursor = await connection.cursor()
+            try:
+                if last is None:
+                    await cursor.execute(
+                        f"SELECT * FROM user_data ORDER BY user_id LIMIT {p}",
+                        (page_size,))
+                else:
+                    await cursor.execute(
+                        f"SELECT * FROM user_data WHERE user_id > {p} "
+                        f"ORDER BY user_id LIMIT {p}", (last, page_size))
+                return _as_dicts(cursor, await cursor.fetchall())
+            finally:
+                await _close(cursor)
+
+        async for page in _prefetched(fetch):
+            yield page
+    finally:
+        if own_connection:
+            await _close(connection)
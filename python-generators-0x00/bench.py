@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+#Benchmarks hors ligne des générateurs, sur une base SQLite qui remplace MySQL
+#usage : python3 bench.py [nom_du_benchmark ...]
+import csv
+import functools
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+import uuid
+
+import columns
+import export
+import seed
+
+stream_users = __import__('0-stream_users').stream_users
+batches = __import__('1-batch_processing')
+pagination = __import__('2-lazy_paginate')
+
+
+#créer une base SQLite avec n utilisateurs synthétiques
+def make_db(n, path=":memory:"):
+    connection = seed.connect_sqlite(path)
+    seed.create_table(connection)
+    connection.executemany(
+        "INSERT INTO user_data (user_id, name, email, age) VALUES (?,?,?,?)",
+        ((str(uuid.uuid4()), f"user {i}", f"user{i}@example.com", 18 + i % 80)
+         for i in range(n)))
+    connection.commit()
+    return connection
+
+
+#pic mémoire (tracemalloc) et durée pour parcourir tout l'itérable
+def measure(make_iterable):
+    tracemalloc.start()
+    start = time.perf_counter()
+    count = 0
+    for _ in make_iterable():
+        count += 1
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return count, elapsed, peak
+
+
+#curseur bufferisé : toute la table est chargée avant la première ligne
+def buffered_users(connection):
+    cursor = seed.dict_cursor(connection)
+    cursor.execute("SELECT * FROM user_data")
+    rows = cursor.fetchall()
+    cursor.close()
+    return rows
+
+
+def bench_stream_users(sizes=(10_000, 100_000, 300_000)):
+    print("stream_users : pic mémoire selon la taille de la table")
+    for n in sizes:
+        connection = make_db(n)
+        for label, make in (
+                ("buffered  ", lambda: buffered_users(connection)),
+                ("unbuffered", lambda: stream_users(
+                    unbuffered=True, connection=connection))):
+            count, elapsed, peak = measure(make)
+            print(f"  {n:>8} rows  {label}  {peak / 1024:>10.1f} KiB"
+                  f"  {count / elapsed:>12.0f} rows/s")
+        connection.close()
+
+
+#latence d'une page selon sa profondeur : LIMIT/OFFSET vs keyset
+def bench_paginate(n=200_000, page_size=100, repeat=20):
+    print(f"lazy_paginate : latence d'une page de {page_size} ({n} rows)")
+    connection = make_db(n)
+    for depth in (0, n // 2, n - page_size):
+        cursor = connection.execute(
+            "SELECT user_id FROM user_data ORDER BY user_id LIMIT 1 OFFSET ?",
+            (max(depth - 1, 0),))
+        after = cursor.fetchone()[0] if depth else None
+        for label, fetch in (
+                ("offset", lambda: pagination.paginate_users(
+                    page_size, depth, connection)),
+                ("keyset", lambda: pagination.paginate_users_after(
+                    connection, page_size, after))):
+            start = time.perf_counter()
+            for _ in range(repeat):
+                fetch()
+            elapsed = (time.perf_counter() - start) / repeat
+            print(f"  page @ {depth:>8}  {label}  {elapsed * 1000:>8.3f} ms")
+    connection.close()
+
+
+#fichier CSV synthétique, avec `duplicates` emails en double
+def make_csv(path, n, duplicates=0.05):
+    with open(path, "w", newline="", encoding="utf-8") as file:
+        writer = csv.writer(file)
+        writer.writerow(["user_id", "name", "email", "age"])
+        for i in range(n):
+            email_id = i if i % int(1 / duplicates) else i // 2
+            writer.writerow([str(uuid.uuid4()), f"user {i}",
+                             f"user{email_id}@example.com", 18 + i % 80])
+
+
+#chargement CSV : une requête par ligne vs executemany par paquets
+def bench_insert(n=10_000):
+    print(f"insert_data : chargement de {n} lignes CSV dans SQLite")
+    with tempfile.TemporaryDirectory() as tmp:
+        csv_file = os.path.join(tmp, "user_data.csv")
+        make_csv(csv_file, n)
+        for label, load in (
+                ("row by row", seed.insert_data),
+                ("bulk      ", lambda c, f: seed.bulk_insert_data(
+                    c, f, progress=False))):
+            db = os.path.join(tmp, f"{label.strip()}.db")
+            connection = seed.connect_sqlite(db)
+            seed.create_table(connection)
+            start = time.perf_counter()
+            load(connection, csv_file)
+            elapsed = time.perf_counter() - start
+            count = connection.execute(
+                "SELECT COUNT(*) FROM user_data").fetchone()[0]
+            print(f"  {label}  {elapsed:>7.2f} s  {n / elapsed:>10.0f} rows/s"
+                  f"  ({count} rows kept)")
+            connection.close()
+
+
+#chargement parallèle par plages du fichier CSV
+def bench_sharded(n=200_000, workers=(1, 2, 4)):
+    print(f"parallel_insert_data : {n} lignes CSV dans SQLite")
+    with tempfile.TemporaryDirectory() as tmp:
+        csv_file = os.path.join(tmp, "user_data.csv")
+        make_csv(csv_file, n)
+        for count in workers:
+            db = os.path.join(tmp, f"users{count}.db")
+            connection = seed.connect_sqlite(db)
+            seed.create_table(connection)
+            connection.close()
+            print(f"  {count} workers")
+            seed.parallel_insert_data(
+                csv_file, functools.partial(seed.connect_sqlite, db),
+                workers=count)
+
+
+#lecture partitionnée : débit selon le nombre de workers
+def bench_partitions(n=300_000, batch_size=1000, workers=(1, 2, 4, 8)):
+    print(f"stream_users_in_batches : lecture de {n} rows par partitions")
+    with tempfile.TemporaryDirectory() as tmp:
+        db = os.path.join(tmp, "users.db")
+        make_db(n, db).close()
+        connect = lambda: seed.connect_sqlite(db)
+        for count in workers:
+            start = time.perf_counter()
+            rows = sum(len(batch) for batch in batches.stream_users_in_batches(
+                batch_size, workers=count, connect=connect))
+            elapsed = time.perf_counter() - start
+            print(f"  {count} workers  {elapsed:>6.2f} s"
+                  f"  {rows / elapsed:>10.0f} rows/s")
+
+
+#filtre age > 25 sur des paquets de tuples tels que lus par le curseur :
+#un dict par ligne puis un if par ligne, vs colonnes filtrées par paquet
+def bench_columnar(n=1_000_000, batch_size=10_000):
+    backend = "numpy" if columns.np is not None else "array"
+    print(f"batch_processing : filtre age > 25 sur {n} utilisateurs ({backend})")
+    rows = [(str(i), f"user {i}", f"user{i}@example.com", 18 + i % 80)
+            for i in range(n)]
+    fetched = [rows[i:i + batch_size] for i in range(0, n, batch_size)]
+    del rows
+    keys = columns.COLUMNS
+
+    def dict_rows():
+        for batch in fetched:
+            users = [user for user in (dict(zip(keys, row)) for row in batch)
+                     if user["age"] > 25]
+            if users:
+                yield users
+
+    def columnar():
+        return columns.filter_batches(
+            (columns.to_columns(batch) for batch in fetched),
+            columns.where("age", ">", 25))
+
+    for label, run in (("dict rows", dict_rows), ("columnar ", columnar)):
+        start = time.perf_counter()
+        kept = 0
+        for batch in run():
+            kept += len(batch) if isinstance(batch, list) else columns.batch_length(batch)
+        elapsed = time.perf_counter() - start
+        print(f"  {label}  {elapsed:>6.3f} s  {n / elapsed:>12.0f} rows/s"
+              f"  ({kept} kept)")
+
+
+#lazy_paginate_offset ouvre une connexion par page : sans pool vs avec pool
+def bench_pool(n=20_000, page_size=100):
+    print(f"lazy_paginate : {n // page_size} pages, connexion par appel vs pool")
+    with tempfile.TemporaryDirectory() as tmp:
+        db = os.path.join(tmp, "users.db")
+        make_db(n, db).close()
+        factory = lambda: seed.connect_sqlite(db)
+        for label, enabled in (("connect/call", False), ("pooled      ", True)):
+            seed.configure_pool(factory, enabled=enabled)
+            start = time.perf_counter()
+            pages = sum(1 for _ in pagination.lazy_paginate_offset(page_size))
+            elapsed = time.perf_counter() - start
+            print(f"  {label}  {elapsed:>6.3f} s  {pages / elapsed:>8.0f} pages/s")
+            if enabled:
+                print(f"  pool metrics: {seed.get_pool().metrics()}")
+        seed.configure_pool()
+
+
+#octets par ligne gardée en mémoire : dict, tuple ou rows.User
+def bench_rows(n=100_000):
+    print(f"stream_users : mémoire par ligne pour {n} lignes gardées")
+    connection = make_db(n)
+    for label, make in (
+            ("dict   ", lambda: stream_users(connection=connection)),
+            ("tuple  ", lambda: stream_users(unbuffered=True,
+                                             connection=connection)),
+            ("compact", lambda: stream_users(connection=connection,
+                                             compact=True))):
+        tracemalloc.start()
+        kept = list(make())
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        print(f"  {label}  {size / len(kept):>7.1f} bytes/row")
+        del kept
+    connection.close()
+
+
+#moyenne des âges : relecture de la base vs fichier en colonnes mappé
+def bench_export(n=300_000):
+    print(f"average_age : {n} rows, base SQLite vs export mmap")
+    ages = __import__('4-stream_ages')
+    with tempfile.TemporaryDirectory() as tmp:
+        connection = make_db(n)
+        path = os.path.join(tmp, "user_data.col")
+        start = time.perf_counter()
+        export.export_users(path, stream_users(
+            unbuffered=True, compact=True, connection=connection))
+        print(f"  export           {time.perf_counter() - start:>7.3f} s"
+              f"  ({os.path.getsize(path) / n:.1f} bytes/row on disk)")
+
+        start = time.perf_counter()
+        values = list(ages.stream_user_ages(connection))
+        avg = sum(values) / len(values)
+        print(f"  stream from db   {time.perf_counter() - start:>7.3f} s  avg {avg:.2f}")
+
+        with export.ColumnarFile(path) as reader:
+            start = time.perf_counter()
+            view = reader.ages()
+            avg = sum(view) / len(view)
+            print(f"  mmap column      {time.perf_counter() - start:>7.3f} s  avg {avg:.2f}")
+            view.release()
+        connection.close()
+
+
+BENCHMARKS = {
+    "stream_users": bench_stream_users,
+    "paginate": bench_paginate,
+    "insert": bench_insert,
+    "sharded": bench_sharded,
+    "partitions": bench_partitions,
+    "columnar": bench_columnar,
+    "pool": bench_pool,
+    "rows": bench_rows,
+    "export": bench_export,
+}
+
+
+if __name__ == "__main__":
+    for name in sys.argv[1:] or BENCHMARKS:
+        BENCHMARKS[name]()
@@ -0,0 +1,89 @@
+import json
+import os
+
+import seed
+
+#Flux incrémental : seulement les lignes insérées ou modifiées depuis le
+#dernier passage. Le point de reprise (updated_at, user_id) de la dernière
+#ligne traitée est gardé dans un fichier JSON local.
+#
+#Les lignes plus récentes que `lag` secondes ne sont pas lues : une
+#transaction encore ouverte peut avoir écrit un updated_at plus ancien que
+#son commit, et serait sinon sautée. `lag` doit dépasser la durée de la plus
+#longue transaction d'écriture.
+
+
+def load_checkpoint(path):
+    try:
+        with open(path, encoding="utf-8") as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return None
+
+
+#écriture atomique : un job interrompu ne laisse jamais un fichier à moitié
+def save_checkpoint(path, checkpoint):
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as file:
+        json.dump(checkpoint, file)
+    os.replace(tmp, path)
+
+
+#limite haute fixée une fois par passage (heure de la base moins `lag`) :
+#toutes les pages sont lues dans le même instantané (REPEATABLE READ, pas
+#de commit entre les pages), une limite qui avancerait à chaque page
+#laisserait passer le point de reprise devant des lignes validées après
+#l'instantané
+def _cutoff(connection, lag):
+    if seed.is_sqlite(connection):
+        expression = f"strftime('%Y-%m-%d %H:%M:%f', 'now', '-{float(lag)} seconds')"
+    else:
+        expression = f"NOW(6) - INTERVAL {int(lag * 1_000_000)} MICROSECOND"
+    cursor = connection.cursor()
+    try:
+        cursor.execute(f"SELECT {expression}")
+        return cursor.fetchone()[0]
+    finally:
+        cursor.close()
+
+
+def _changed_page(connection, checkpoint, cutoff, page_size):
+    p = seed.placeholder(connection)
+    cursor = seed.dict_cursor(connection)
+    conditions = [f"updated_at <= {p}"]
+    params = [cutoff]
+    if checkpoint:
+        conditions.append(
+            f"(updated_at > {p} OR (updated_at = {p} AND user_id > {p}))")
+        params += [checkpoint["updated_at"], checkpoint["updated_at"],
+                   checkpoint["user_id"]]
+    cursor.execute(
+        f"SELECT * FROM user_data WHERE {' AND '.join(conditions)} "
+        f"ORDER BY updated_at, user_id LIMIT {int(page_size)}", params)
+    rows = cursor.fetchall()
+    cursor.close()
+    return rows
+
+
+#rend les lignes changées depuis le dernier passage ; le point de reprise
+#est enregistré après chaque page traitée (au moins une fois : une page
+#interrompue sera relue au prochain passage)
+def stream_changes(checkpoint_path, page_size=1000, lag=1.0, connection=None):
+    own_connection = connection is None
+    if own_connection:
+        connection = seed.connect_to_prodev()
+    checkpoint = load_checkpoint(checkpoint_path)
+    try:
+        cutoff = _cutoff(connection, lag)
+        while True:
+            page = _changed_page(connection, checkpoint, cutoff, page_size)
+            if not page:
+                break
+            yield from page
+            last = page[-1]
+            checkpoint = {"updated_at": str(last["updated_at"]),
+                          "user_id": last["user_id"]}
+            save_checkpoint(checkpoint_path, checkpoint)
+    finally:
+        if own_connection:
+            connection.close()
@@ -0,0 +1,88 @@
+import operator
+from array import array
+from itertools import compress, repeat
+
+#NumPy est optionnel : avec lui les filtres tournent en C sur des tableaux,
+#sans lui les colonnes sont des array/list de la bibliothèque standard
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+COLUMNS = ("user_id", "name", "email", "age")
+
+OPERATORS = {
+    ">": operator.gt,
+    ">=": operator.ge,
+    "<": operator.lt,
+    "<=": operator.le,
+    "==": operator.eq,
+    "!=": operator.ne,
+}
+
+
+#un paquet de lignes (tuples) -> un dict de colonnes ; age est stocké dans
+#un array de doubles au lieu d'un objet par ligne
+def to_columns(rows):
+    user_id, name, email, age = zip(*rows) if rows else ((), (), (), ())
+    if np is not None:
+        return {
+            "user_id": np.array(user_id, dtype=object),
+            "name": np.array(name, dtype=object),
+            "email": np.array(email, dtype=object),
+            "age": np.fromiter(map(float, age), dtype=np.float64, count=len(age)),
+        }
+    return {
+        "user_id": list(user_id),
+        "name": list(name),
+        "email": list(email),
+        "age": array("d", map(float, age)),
+    }
+
+
+def batch_length(batch):
+    return len(batch["user_id"])
+
+
+#prédicat sur une colonne entière : renvoie un masque de booléens calculé
+#par map() (boucle en C) au lieu d'un if par ligne en Python
+def where(column, op, value):
+    compare = OPERATORS[op]
+
+    def predicate(batch):
+        values = batch[column]
+        if np is not None and isinstance(values, np.ndarray):
+            return compare(values, value)
+        return list(map(compare, values, repeat(value)))
+    return predicate
+
+
+#garder seulement les lignes dont le masque est vrai, colonne par colonne
+def select(batch, mask):
+    selected = {}
+    for name, values in batch.items():
+        if np is not None and isinstance(values, np.ndarray):
+            selected[name] = values[mask]
+        elif isinstance(values, array):
+            selected[name] = array(values.typecode, compress(values, mask))
+        else:
+            selected[name] = list(compress(values, mask))
+    return selected
+
+
+#applique les prédicats (combinés par ET) à chaque paquet et ne rend que
+#les paquets non vides
+def filter_batches(batches, *predicates):
+    for batch in batches:
+        mask = None
+        for predicate in predicates:
+            current = predicate(batch)
+            if mask is None:
+                mask = current
+            elif np is not None and isinstance(mask, np.ndarray):
+                mask = mask & current
+            else:
+                mask = list(map(operator.and_, mask, current))
+        selected = batch if mask is None else select(batch, mask)
+        if batch_length(selected):
+            yield selected
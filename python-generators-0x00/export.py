@@ -0,0 +1,173 @@
+import mmap
+import shutil
+import struct
+import sys
+import tempfile
+from array import array
+
+from rows import User
+
+#Export de user_data dans un fichier binaire en colonnes, relu par mmap :
+#
+#    en-tête   MAGIC, nombre de lignes, puis (offset, taille) de chaque section
+#    age       n doubles (float64)
+#    user_id   n + 1 offsets (uint64) puis les octets UTF-8 bout à bout
+#    name      idem
+#    email     idem
+#
+#Tous les nombres sont en little-endian et chaque section commence sur un
+#multiple de 8 octets, pour pouvoir la relire avec memoryview.cast sans copie.
+
+MAGIC = b"UDCOL001"
+STRINGS = ("user_id", "name", "email")
+SECTIONS = ("age",) + tuple(f"{name}.{part}" for name in STRINGS
+                            for part in ("offsets", "data"))
+_HEADER = struct.Struct("<8sQ" + "QQ" * len(SECTIONS))
+_SWAP = sys.byteorder != "little"
+
+
+def _write_array(file, values):
+    if _SWAP:
+        values = array(values.typecode, values)
+        values.byteswap()
+    values.tofile(file)
+
+
+#écrit les lignes (tuples ou rows.User) dans `path` ; les colonnes passent
+#par des fichiers temporaires pour que la mémoire reste bornée
+def export_users(path, users=None, batch_size=10_000):
+    if users is None:
+        stream_users = __import__('0-stream_users').stream_users
+        users = stream_users(unbuffered=True, compact=True)
+
+    parts = {name: tempfile.TemporaryFile() for name in SECTIONS}
+    try:
+        count = 0
+        ends = {name: 0 for name in STRINGS}
+        for name in STRINGS:
+            _write_array(parts[f"{name}.offsets"], array("Q", [0]))
+
+        ages = array("d")
+        offsets = {name: array("Q") for name in STRINGS}
+        data = {name: bytearray() for name in STRINGS}
+
+        def flush():
+            _write_array(parts["age"], ages)
+            del ages[:]
+            for name in STRINGS:
+                _write_array(parts[f"{name}.offsets"], offsets[name])
+                parts[f"{name}.data"].write(data[name])
+                del offsets[name][:]
+                data[name].clear()
+
+        for user in users:
+            if isinstance(user, User):
+                user = (user.user_id, user.name, user.email, user.age)
+            ages.append(float(user[3]))
+            for name, value in zip(STRINGS, user):
+                encoded = str(value).encode("utf-8")
+                data[name] += encoded
+                ends[name] += len(encoded)
+                offsets[name].append(ends[name])
+            count += 1
+            if len(ages) >= batch_size:
+                flush()
+        flush()
+
+        with open(path, "wb") as out:
+            position = _HEADER.size
+            table = []
+            for name in SECTIONS:
+                position += -position % 8
+                size = parts[name].tell()
+                table += [position, size]
+                position += size
+            out.write(_HEADER.pack(MAGIC, count, *table))
+            for name in SECTIONS:
+                out.write(b"\0" * (-out.tell() % 8))
+                parts[name].seek(0)
+                shutil.copyfileobj(parts[name], out)
+        return count
+    finally:
+        for part in parts.values():
+            part.close()
+
+
+#colonne de chaînes : décodée seulement quand on lit un élément
+class StringColumn:
+    def __init__(self, offsets, data):
+        self.offsets = offsets
+        self.data = data
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return str(self.data[self.offsets[index]:self.offsets[index + 1]],
+                   "utf-8")
+
+    def __iter__(self):
+        offsets, data = self.offsets, self.data
+        for i in range(len(self)):
+            yield str(data[offsets[i]:offsets[i + 1]], "utf-8")
+
+
+#lecture d'un export : le fichier est mappé en mémoire et les colonnes sont
+#des vues dessus (aucune copie, pages chargées par le système à la demande)
+class ColumnarFile:
+    def __init__(self, path):
+        self._file = open(path, "rb")
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._map)
+        magic, self.count, *table = _HEADER.unpack_from(self._map)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError(f"{path} is not a user_data columnar export")
+        self._sections = {name: (table[2 * i], table[2 * i + 1])
+                          for i, name in enumerate(SECTIONS)}
+
+    def _section(self, name, typecode=None):
+        offset, size = self._sections[name]
+        view = self._view[offset:offset + size]
+        if typecode is None:
+            return view
+        if _SWAP:
+            values = array(typecode, view.tobytes())
+            values.byteswap()
+            return values
+        return view.cast(typecode)
+
+    def __len__(self):
+        return self.count
+
+    #colonne age : memoryview de doubles, utilisable par sum(), stats, etc.
+    def ages(self):
+        return self._section("age", "d")
+
+    def column(self, name):
+        if name == "age":
+            return self.ages()
+        return StringColumn(self._section(f"{name}.offsets", "Q"),
+                            self._section(f"{name}.data"))
+
+    def rows(self):
+        columns = [self.column(name) for name in STRINGS]
+        return zip(*columns, self.ages())
+
+    #les vues rendues par ages()/column() doivent être libérées avant
+    #(sinon mmap refuse de se fermer : BufferError)
+    def close(self):
+        self._sections = {}
+        self._view.release()
+        self._map.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,139 @@
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+#Pipelines paresseux construits sur les générateurs du projet :
+#
+#    users = __import__('0-stream_users').stream_users
+#    job = (source(users(unbuffered=True))
+#           | filter_(lambda u: u[3] > 25)
+#           | map_(enrich, workers=4)
+#           | batch(500)
+#           | sink(save))
+#    job.run()
+#    job.report()
+#
+#Chaque étape tire les éléments de la précédente (rien n'est lu d'avance,
+#sauf les `workers` appels en cours d'un map_ parallèle), et compte les
+#éléments produits et le temps passé.
+
+
+class Stage:
+    def __init__(self, name, apply):
+        self.name = name
+        self.apply = apply
+        self.items = 0
+        self.seconds = 0.0      # temps inclusif (étapes précédentes comprises)
+
+
+class Pipeline:
+    def __init__(self, stages):
+        self.stages = stages
+
+    def __or__(self, stage):
+        return Pipeline(self.stages + [stage])
+
+    def __iter__(self):
+        iterator = iter(())
+        for stage in self.stages:
+            iterator = _timed(stage.apply(iterator), stage)
+        return iterator
+
+    #consomme tout le pipeline ; rend le nombre d'éléments sortis
+    def run(self):
+        count = 0
+        for _ in self:
+            count += 1
+        return count
+
+    #temps propre de chaque étape = temps inclusif - celui de l'étape d'avant
+    def stats(self):
+        result = []
+        previous = 0.0
+        for stage in self.stages:
+            result.append({"stage": stage.name, "items": stage.items,
+                           "seconds": max(stage.seconds - previous, 0.0)})
+            previous = stage.seconds
+        return result
+
+    def report(self):
+        for row in self.stats():
+            print(f"{row['stage']:<20} {row['items']:>10} items"
+                  f" {row['seconds']:>10.3f} s")
+
+
+def _timed(iterator, stage):
+    while True:
+        start = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            stage.seconds += time.perf_counter() - start
+            return
+        stage.seconds += time.perf_counter() - start
+        stage.items += 1
+        yield item
+
+
+def source(iterable, name="source"):
+    return Pipeline([Stage(name, lambda _: iter(iterable))])
+
+
+#workers > 1 : fn tourne dans un pool de threads, au plus `workers * 2`
+#appels en cours (backpressure), résultats rendus dans l'ordre
+def map_(fn, workers=1, name=None):
+    name = name or f"map {getattr(fn, '__name__', 'fn')}"
+    if workers <= 1:
+        return Stage(name, lambda items: (fn(item) for item in items))
+
+    def apply(items):
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            pending = deque()
+            for item in items:
+                pending.append(pool.submit(fn, item))
+                if len(pending) >= workers * 2:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+    return Stage(name, apply)
+
+
+def filter_(predicate, name=None):
+    name = name or f"filter {getattr(predicate, '__name__', 'fn')}"
+    return Stage(name, lambda items: (item for item in items if predicate(item)))
+
+
+def batch(size, name=None):
+    def apply(items):
+        while True:
+            chunk = list(islice(items, size))
+            if not chunk:
+                return
+            yield chunk
+    return Stage(name or f"batch {size}", apply)
+
+
+#fenêtre glissante de `size` éléments qui avance de `step`
+def window(size, step=1, name=None):
+    def apply(items):
+        current = deque(maxlen=size)
+        since = 0
+        for item in items:
+            current.append(item)
+            since += 1
+            if len(current) == size and since >= step:
+                since = 0
+                yield tuple(current)
+    return Stage(name or f"window {size}", apply)
+
+
+#dernière étape : fn reçoit chaque élément (écriture en base, fichier...)
+def sink(fn, name=None):
+    name = name or f"sink {getattr(fn, '__name__', 'fn')}"
+
+    def apply(items):
+        for item in items:
+            fn(item)
+            yield item
+    return Stage(name, apply)
@@ -0,0 +1,171 @@
+import threading
+import time
+import weakref
+
+
+#connexion prêtée par le pool : s'utilise comme la vraie connexion, mais
+#close() la rend au pool au lieu de la fermer. Une connexion oubliée (erreur
+#avant le close(), générateur abandonné) est rendue quand elle disparaît.
+class PooledConnection:
+    def __init__(self, pool, raw, created):
+        self.raw = raw
+        self.created = created
+        self.last_used = time.monotonic()
+        self._release = (weakref.finalize(self, pool._release, raw, created)
+                         if pool is not None else None)
+
+    def __getattr__(self, name):
+        return getattr(self.raw, name)
+
+    def close(self):
+        if self._release is not None:
+            self._release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def _ping(connection):
+    cursor = connection.cursor()
+    try:
+        cursor.execute("SELECT 1")
+        cursor.fetchall()
+    finally:
+        cursor.close()
+
+
+#pool de connexions partagé entre threads :
+#  max_size      nombre max de connexions ouvertes en même temps
+#  timeout       attente max (s) quand toutes sont prêtées
+#  idle_timeout  une connexion inutilisée plus longtemps est fermée
+#  max_lifetime  une connexion plus vieille est fermée et remplacée
+#  ping          vérification faite à chaque emprunt
+class ConnectionPool:
+    def __init__(self, factory, max_size=10, timeout=30.0, idle_timeout=300.0,
+                 max_lifetime=3600.0, ping=_ping):
+        self.factory = factory
+        self.max_size = max_size
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self.max_lifetime = max_lifetime
+        self.ping = ping
+        self._idle = []
+        self._opened = 0
+        self._lock = threading.Condition()
+        self.stats = {"checkouts": 0, "misses": 0, "waits": 0,
+                      "wait_seconds": 0.0, "evictions": 0,
+                      "health_failures": 0}
+
+    def _expired(self, item, now):
+        return (now - item.last_used > self.idle_timeout
+                or now - item.created > self.max_lifetime)
+
+    def _discard(self, raw):
+        self._opened -= 1
+        try:
+            raw.close()
+        except Exception:
+            pass
+
+    #emprunter une connexion (la rendre avec close())
+    def connect(self):
+        start = time.monotonic()
+        waited = False
+        with self._lock:
+            self.stats["checkouts"] += 1
+        while True:
+            item = None
+            with self._lock:
+                while True:
+                    now = time.monotonic()
+                    while self._idle:
+                        item = self._idle.pop()
+                        if not self._expired(item, now):
+                            break
+                        self.stats["evictions"] += 1
+                        self._discard(item.raw)
+                        item = None
+                    if item is not None:
+                        break
+                    if self._opened < self.max_size:
+                        self._opened += 1
+                        self.stats["misses"] += 1
+                        break
+                    remaining = self.timeout - (now - start)
+                    if remaining <= 0:
+                        raise TimeoutError(
+                            f"no connection available after {self.timeout}s")
+                    waited = True
+                    self._lock.wait(remaining)
+
+            if item is None:
+                break
+            # vérification hors du verrou : un aller-retour réseau ne doit
+            # pas bloquer les autres emprunts
+            if self._healthy(item.raw):
+                self._record_wait(waited, start)
+                return PooledConnection(self, item.raw, item.created)
+
+        # ouverture hors du verrou : elle peut être lente
+        self._record_wait(waited, start)
+        try:
+            raw = self.factory()
+        except Exception:
+            with self._lock:
+                self._opened -= 1
+                self._lock.notify()
+            raise
+        return PooledConnection(self, raw, time.monotonic())
+
+    def _record_wait(self, waited, start):
+        if waited:
+            with self._lock:
+                self.stats["waits"] += 1
+                self.stats["wait_seconds"] += time.monotonic() - start
+
+    def _healthy(self, raw):
+        if self.ping is None:
+            return True
+        try:
+            self.ping(raw)
+            return True
+        except Exception:
+            with self._lock:
+                self.stats["health_failures"] += 1
+                self._discard(raw)
+                self._lock.notify()
+            return False
+
+    def release(self, connection):
+        connection.close()
+
+    def _release(self, raw, created):
+        # on ne rend pas une transaction ouverte ou des lignes non lues
+        try:
+            if hasattr(raw, "consume_results"):
+                raw.consume_results()
+            raw.rollback()
+        except Exception:
+            with self._lock:
+                self._discard(raw)
+                self._lock.notify()
+            return
+        with self._lock:
+            if time.monotonic() - created > self.max_lifetime:
+                self.stats["evictions"] += 1
+                self._discard(raw)
+            else:
+                self._idle.append(PooledConnection(None, raw, created))
+            self._lock.notify()
+
+    def close(self):
+        with self._lock:
+            while self._idle:
+                self._discard(self._idle.pop().raw)
+
+    def metrics(self):
+        with self._lock:
+            return dict(self.stats, opened=self._opened, idle=len(self._idle))
@@ -0,0 +1,30 @@
+#ligne user_data compacte : __slots__ au lieu d'un dict par utilisateur
+#(pas de table de hachage ni de clés répétées), age en int au lieu de Decimal
+class User:
+    __slots__ = ("user_id", "name", "email", "age")
+
+    FIELDS = ("user_id", "name", "email", "age")
+    SELECT = "SELECT user_id, name, email, age FROM user_data"
+
+    def __init__(self, user_id, name, email, age):
+        self.user_id = user_id
+        self.name = name
+        self.email = email
+        self.age = int(age)
+
+    #construit un User depuis un tuple (user_id, name, email, age)
+    @classmethod
+    def from_row(cls, row):
+        return cls(*row)
+
+    def as_dict(self):
+        return {field: getattr(self, field) for field in self.FIELDS}
+
+    def __repr__(self):
+        return (f"User(user_id={self.user_id!r}, name={self.name!r}, "
+                f"email={self.email!r}, age={self.age!r})")
+
+    def __eq__(self, other):
+        if not isinstance(other, User):
+            return NotImplemented
+        return all(getattr(self, f) == getattr(other, f) for f in self.FIELDS)
@@ -1,8 +1,12 @@
-import mysql.connector
+import sqlite3
+
+from pool import ConnectionPool
+
 
 #pour se connecter au serveur MYSQL
 def connect_db():
-       connection= mysql.connector.connect(
+    import mysql.connector
+    connection = mysql.connector.connect(
         host="localhost",
         user="root",
         password="password"
@@ -10,15 +14,16 @@ def connect_db():
     return connection
 
 
-#créer une base de donnée si elle n'existe pas 
+#créer une base de donnée si elle n'existe pas
 def create_database(connection):
     cursor = connection.cursor()
     cursor.execute("CREATE DATABASE IF NOT EXISTS ALX_prodev")
     connection.commit()
     cursor.close()
 
-#se connecter à la base de donnée
-def connect_to_prodev():
+#ouvrir une nouvelle connexion à la base de donnée
+def open_prodev():
+    import mysql.connector
     return mysql.connector.connect(
         host="localhost",
         user="root",
@@ -26,33 +31,319 @@ def connect_to_prodev():
         database="ALX_prodev"
     )
 
+
+#pool partagé par tout le processus (créé au premier emprunt)
+_pool = None
+_pool_factory = open_prodev
+_pool_enabled = True
+_pool_options = {}
+
+
+#changer la connexion utilisée (ex: SQLite) ou les réglages du pool ;
+#enabled=False : une connexion neuve à chaque appel, comme avant
+def configure_pool(factory=None, enabled=True, **options):
+    global _pool, _pool_factory, _pool_enabled, _pool_options
+    if _pool is not None:
+        _pool.close()
+    _pool = None
+    _pool_factory = factory or open_prodev
+    _pool_enabled = enabled
+    _pool_options = options
+
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        _pool = ConnectionPool(_pool_factory, **_pool_options)
+    return _pool
+
+
+#se connecter à la base de donnée ; close() rend la connexion au pool
+def connect_to_prodev():
+    if not _pool_enabled:
+        return _pool_factory()
+    return get_pool().connect()
+
+
+#base SQLite qui remplace MySQL (tests, benchmarks hors ligne)
+#check_same_thread=False : une connexion du pool peut être rendue par un
+#thread et reprise par un autre
+def connect_sqlite(path=":memory:", timeout=30.0):
+    return sqlite3.connect(path, timeout=timeout, check_same_thread=False)
+
+
+def is_sqlite(connection):
+    return isinstance(getattr(connection, "raw", connection), sqlite3.Connection)
+
+
+#marqueur de paramètre SQL : %s pour MySQL, ? pour SQLite
+def placeholder(connection):
+    return "?" if is_sqlite(connection) else "%s"
+
+
+#curseur qui retourne les lignes comme des dictionnaires
+def dict_cursor(connection):
+    if not is_sqlite(connection):
+        return connection.cursor(dictionary=True)
+    cursor = connection.cursor()
+    cursor.row_factory = lambda c, row: dict(
+        zip([col[0] for col in c.description], row))
+    return cursor
+
+
+#curseur non bufferisé : les lignes restent côté serveur et arrivent en tuples
+#(sqlite3 lit déjà ligne par ligne)
+def stream_cursor(connection):
+    if is_sqlite(connection):
+        return connection.cursor()
+    return connection.cursor(buffered=False)
+
+
+#updated_at : date de la dernière insertion/modification de la ligne, utilisée
+#par changes.py pour ne relire que ce qui a changé
+NOW_SQLITE = "strftime('%Y-%m-%d %H:%M:%f', 'now')"
+UPDATED_AT_MYSQL = ("updated_at TIMESTAMP(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6) "
+                    "ON UPDATE CURRENT_TIMESTAMP(6)")
+
+
 #créer une table
 def create_table(connection):
+    if is_sqlite(connection):
+        updated_at = f"updated_at TEXT NOT NULL DEFAULT ({NOW_SQLITE})"
+    else:
+        updated_at = UPDATED_AT_MYSQL
     cursor =connection.cursor()
-    cursor.execute("CREATE TABLE IF NOT EXISTS user_data (user_id VARCHAR(36) PRIMARY KEY, name VARCHAR(255) NOT NULL, email VARCHAR(255) NOT NULL, age DECIMAL NOT NULL)")
+    cursor.execute(f"CREATE TABLE IF NOT EXISTS user_data (user_id VARCHAR(36) PRIMARY KEY, name VARCHAR(255) NOT NULL, email VARCHAR(255) NOT NULL, age DECIMAL NOT NULL, {updated_at})")
     connection.commit()
+    cursor.close()
+    enable_change_tracking(connection)
     print("table user_data created successfully")
+
+
+#ajoute updated_at (et son index) à une table créée avant cette colonne ;
+#SQLite n'a pas de ON UPDATE : des triggers mettent la date à jour
+def enable_change_tracking(connection):
+    cursor = connection.cursor()
+    if is_sqlite(connection):
+        cursor.execute("PRAGMA table_info(user_data)")
+        if "updated_at" not in [col[1] for col in cursor.fetchall()]:
+            # ALTER TABLE n'accepte qu'une valeur par défaut constante
+            cursor.execute("ALTER TABLE user_data ADD COLUMN updated_at TEXT "
+                           "NOT NULL DEFAULT '1970-01-01 00:00:00.000'")
+            cursor.execute(f"UPDATE user_data SET updated_at = {NOW_SQLITE}")
+            cursor.execute(
+                "CREATE TRIGGER IF NOT EXISTS user_data_touch_insert "
+                "AFTER INSERT ON user_data FOR EACH ROW BEGIN "
+                f"UPDATE user_data SET updated_at = {NOW_SQLITE} "
+                "WHERE user_id = NEW.user_id; END")
+        cursor.execute(
+            "CREATE TRIGGER IF NOT EXISTS user_data_touch_update "
+            "AFTER UPDATE ON user_data FOR EACH ROW "
+            "WHEN NEW.updated_at = OLD.updated_at BEGIN "
+            f"UPDATE user_data SET updated_at = {NOW_SQLITE} "
+            "WHERE user_id = NEW.user_id; END")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_user_updated "
+                       "ON user_data (updated_at, user_id)")
+    else:
+        cursor.execute("SHOW COLUMNS FROM user_data LIKE 'updated_at'")
+        if not cursor.fetchall():
+            cursor.execute(f"ALTER TABLE user_data ADD COLUMN {UPDATED_AT_MYSQL}")
+        cursor.execute("SHOW INDEX FROM user_data WHERE Key_name = 'idx_user_updated'")
+        if not cursor.fetchall():
+            cursor.execute("CREATE INDEX idx_user_updated "
+                           "ON user_data (updated_at, user_id)")
+    connection.commit()
     cursor.close()
 
 
 #inserer les données depuis le fichier CSV
-import csv 
-import uuid 
+import csv
+import itertools
+import time
+import uuid
 
-def insert_data(connection,  user_data.csv):
+def insert_data(connection, csv_file):
+    p = placeholder(connection)
     cursor = connection.cursor()
-    with open(user_data.csv, newline='',encoding='utf-8') as file:
+    with open(csv_file, newline='',encoding='utf-8') as file:
          reader = csv.DictReader(file)
          for row in reader:
              cursor.execute(
-                 "SELECT * FROM user_data WHERE email = %s", (row['email'])
+                 f"SELECT * FROM user_data WHERE email = {p}", (row['email'],)
                  )
              if not cursor.fetchone():
                 cursor.execute(
-                  "INSERT INTO user_data (user_id, name,email,age) VALUES (%s,%s,%s,%s)",
+                  f"INSERT INTO user_data (user_id, name,email,age) VALUES ({p},{p},{p},{p})",
                   (row['user_id'],row['name'],row['email'],row['age'])
                 )
-connection.commit()
-cursor.close()
+    connection.commit()
+    cursor.close()
+
+
+#index unique sur email : c'est la base qui élimine les doublons
+def create_email_index(connection):
+    cursor = connection.cursor()
+    if is_sqlite(connection):
+        cursor.execute(
+            "CREATE UNIQUE INDEX IF NOT EXISTS idx_user_email ON user_data (email)")
+    else:
+        cursor.execute("SHOW INDEX FROM user_data WHERE Key_name = 'idx_user_email'")
+        if not cursor.fetchall():
+            cursor.execute("CREATE UNIQUE INDEX idx_user_email ON user_data (email)")
+    connection.commit()
+    cursor.close()
+
+
+#chargement en masse : executemany par paquets de `batch_size` lignes,
+#INSERT IGNORE / INSERT OR IGNORE au lieu d'un SELECT par ligne, et un
+#commit toutes les `commit_every` lignes
+def bulk_insert_data(connection, csv_file, batch_size=1000, commit_every=10000,
+                     progress=True):
+    create_email_index(connection)
+    p = placeholder(connection)
+    ignore = "OR IGNORE" if is_sqlite(connection) else "IGNORE"
+    sql = (f"INSERT {ignore} INTO user_data (user_id, name, email, age) "
+           f"VALUES ({p},{p},{p},{p})")
+
+    cursor = connection.cursor()
+    read = inserted = pending = 0
+    start = time.perf_counter()
+    with open(csv_file, newline='', encoding='utf-8') as file:
+        reader = csv.DictReader(file)
+        rows = ((row.get('user_id') or str(uuid.uuid4()), row['name'],
+                 row['email'], row['age']) for row in reader)
+        while True:
+            batch = list(itertools.islice(rows, batch_size))
+            if not batch:
+                break
+            cursor.executemany(sql, batch)
+            read += len(batch)
+            inserted += max(cursor.rowcount, 0)
+            pending += len(batch)
+            if pending >= commit_every:
+                connection.commit()
+                pending = 0
+                if progress:
+                    elapsed = time.perf_counter() - start
+                    print(f"{read} rows read, {inserted} inserted "
+                          f"({read / elapsed:.0f} rows/s)")
+    connection.commit()
+    cursor.close()
+
+    elapsed = time.perf_counter() - start
+    if progress:
+        print(f"done: {read} rows read, {inserted} inserted in {elapsed:.2f}s "
+              f"({read / elapsed if elapsed else 0:.0f} rows/s)")
+    return read, inserted
+
+
+#chargement parallèle d'un gros CSV : le fichier est coupé en `workers`
+#plages d'octets alignées sur des débuts de ligne (les champs ne doivent
+#donc pas contenir de retour à la ligne), chaque plage est lue par un
+#processus avec sa propre connexion, dans une table de transit avec la
+#position de la ligne dans le fichier. La fusion finale insère dans l'ordre
+#du fichier : c'est toujours la première ligne d'un email qui est gardée,
+#quel que soit l'ordre de fin des processus.
+#`connect` doit pouvoir être envoyé à un processus (fonction du module,
+#functools.partial...).
+
+import functools
+from concurrent.futures import ProcessPoolExecutor
+
+STAGING_TABLE = "user_data_staging"
+
+
+def csv_shards(csv_file, shards):
+    with open(csv_file, "rb") as file:
+        header = file.readline()
+        start = file.tell()
+        file.seek(0, 2)
+        size = file.tell()
+        bounds = [start]
+        for k in range(1, shards):
+            file.seek(max(start + (size - start) * k // shards - 1, bounds[-1]))
+            file.readline()                 # aller au début de la ligne suivante
+            bounds.append(max(file.tell(), bounds[-1]))
+        bounds.append(size)
+    fields = next(csv.reader([header.decode("utf-8-sig")]))
+    return fields, [(low, high) for low, high in zip(bounds, bounds[1:])
+                    if high > low]
+
+
+def _load_shard(connect, csv_file, fields, low, high, batch_size, index):
+    start = time.perf_counter()
+    connection = connect()
+    p = placeholder(connection)
+    sql = (f"INSERT INTO {STAGING_TABLE} (pos, user_id, name, email, age) "
+           f"VALUES ({p},{p},{p},{p},{p})")
+    cursor = connection.cursor()
+    rows = 0
+    batch = []
+    try:
+        with open(csv_file, "rb") as file:
+            file.seek(low)
+            while file.tell() < high:
+                pos = file.tell()
+                line = file.readline()
+                if not line.strip():
+                    continue
+                row = dict(zip(fields, next(csv.reader([line.decode("utf-8")]))))
+                batch.append((pos, row.get('user_id') or str(uuid.uuid4()),
+                              row['name'], row['email'], row['age']))
+                if len(batch) >= batch_size:
+                    cursor.executemany(sql, batch)
+                    connection.commit()
+                    rows += len(batch)
+                    batch = []
+        if batch:
+            cursor.executemany(sql, batch)
+            connection.commit()
+            rows += len(batch)
+    finally:
+        cursor.close()
+        connection.close()
+    return index, rows, time.perf_counter() - start
+
+
+def parallel_insert_data(csv_file, connect=open_prodev, workers=4,
+                         batch_size=5000, progress=True):
+    start = time.perf_counter()
+    connection = connect()
+    create_email_index(connection)
+    cursor = connection.cursor()
+    cursor.execute(f"DROP TABLE IF EXISTS {STAGING_TABLE}")
+    cursor.execute(f"CREATE TABLE {STAGING_TABLE} (pos BIGINT NOT NULL, "
+                   "user_id VARCHAR(36) NOT NULL, name VARCHAR(255) NOT NULL, "
+                   "email VARCHAR(255) NOT NULL, age DECIMAL NOT NULL)")
+    connection.commit()
+
+    try:
+        fields, shards = csv_shards(csv_file, workers)
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(
+                functools.partial(_load_shard, connect, csv_file, fields),
+                [low for low, _ in shards], [high for _, high in shards],
+                [batch_size] * len(shards), range(len(shards))))
+        read = sum(rows for _, rows, _ in results)
+        if progress:
+            for index, rows, seconds in results:
+                print(f"shard {index}: {rows} rows in {seconds:.2f}s "
+                      f"({rows / seconds if seconds else 0:.0f} rows/s)")
 
+        ignore = "OR IGNORE" if is_sqlite(connection) else "IGNORE"
+        cursor.execute(
+            f"INSERT {ignore} INTO user_data (user_id, name, email, age) "
+            f"SELECT user_id, name, email, age FROM {STAGING_TABLE} ORDER BY pos")
+        inserted = cursor.rowcount
+        connection.commit()
+    finally:
+        cursor.execute(f"DROP TABLE IF EXISTS {STAGING_TABLE}")
+        connection.commit()
+        cursor.close()
+        connection.close()
 
+    elapsed = time.perf_counter() - start
+    if progress:
+        print(f"done: {read} rows read, {inserted} inserted in {elapsed:.2f}s "
+              f"({read / elapsed if elapsed else 0:.0f} rows/s)")
+    return read, inserted
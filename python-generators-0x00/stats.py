@@ -0,0 +1,74 @@
+import math
+import random
+
+
+#statistiques calculées en un seul passage sur un générateur :
+#moyenne/variance de Welford (stables numériquement) et un échantillon
+#de taille fixe (reservoir sampling) pour estimer les percentiles
+class RunningStats:
+    def __init__(self, sample_size=1024, seed=None):
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+        self.mean = 0.0
+        self._m2 = 0.0
+        self.sample_size = sample_size
+        self._sample = []
+        self._random = random.Random(seed)
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (value - self.mean)
+
+        # reservoir : chaque valeur a la même probabilité d'être gardée
+        if len(self._sample) < self.sample_size:
+            self._sample.append(value)
+        else:
+            j = self._random.randrange(self.count)
+            if j < self.sample_size:
+                self._sample[j] = value
+
+    def update(self, values):
+        for value in values:
+            self.add(value)
+        return self
+
+    @property
+    def variance(self):
+        return self._m2 / (self.count - 1) if self.count > 1 else 0.0
+
+    @property
+    def stddev(self):
+        return math.sqrt(self.variance)
+
+    #percentile estimé (exact tant que count <= sample_size), p entre 0 et 100
+    def percentile(self, p):
+        if not self._sample:
+            return None
+        ordered = sorted(self._sample)
+        rank = (len(ordered) - 1) * p / 100
+        low = math.floor(rank)
+        high = min(low + 1, len(ordered) - 1)
+        return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+    def summary(self, percentiles=(50, 90, 99)):
+        result = {
+            "count": self.count,
+            "sum": self.total,
+            "min": self.min,
+            "max": self.max,
+            "avg": self.mean if self.count else None,
+            "stddev": self.stddev,
+        }
+        for p in percentiles:
+            result[f"p{p}"] = self.percentile(p)
+        return result
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""Tests for the incremental change stream in changes.py.
+"""
+import contextlib
+import io
+import os
+import tempfile
+import unittest
+
+import changes
+import seed
+
+OLD = "2020-01-01 00:00:00.000"
+
+
+class TestStreamChanges(unittest.TestCase):
+    """stream_changes on an SQLite user_data table"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.checkpoint = os.path.join(self.tmp.name, "checkpoint.json")
+        self.connection = seed.connect_sqlite()
+        with contextlib.redirect_stdout(io.StringIO()):
+            seed.create_table(self.connection)
+
+    def tearDown(self):
+        self.connection.close()
+        self.tmp.cleanup()
+
+    def insert(self, user_id, updated_at=OLD):
+        self.connection.execute(
+            "INSERT INTO user_data (user_id, name, email, age, updated_at) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (user_id, f"name {user_id}", f"{user_id}@example.com", 30,
+             updated_at))
+        self.connection.commit()
+
+    def ids(self, page_size=1000, lag=0.0):
+        return [row["user_id"] for row in changes.stream_changes(
+            self.checkpoint, page_size=page_size, lag=lag,
+            connection=self.connection)]
+
+    def test_first_run_then_empty_run(self):
+        """The first run returns every row once, the second one nothing"""
+        for i, stamp in enumerate(["2020-01-03", "2020-01-01", "2020-01-02"]):
+            self.insert(f"u{i}", f"{stamp} 00:00:00.000")
+
+        self.assertEqual(self.ids(page_size=2), ["u1", "u2", "u0"])
+        self.assertEqual(changes.load_checkpoint(self.checkpoint),
+                         {"updated_at": "2020-01-03 00:00:00.000",
+                          "user_id": "u0"})
+        self.assertEqual(self.ids(page_size=2), [])
+
+    def test_only_updated_rows(self):
+        """After a run, only the rows modified since are returned"""
+        for i in range(5):
+            self.insert(f"u{i}")
+        self.assertEqual(len(self.ids()), 5)
+
+        self.connection.execute(
+            "UPDATE user_data SET age = 40 WHERE user_id IN ('u1', 'u3')")
+        self.connection.commit()
+        self.assertEqual(sorted(self.ids()), ["u1", "u3"])
+        self.assertEqual(self.ids(), [])
+
+    def test_resume_mid_page(self):
+        """An interrupted run resumes after the last saved checkpoint"""
+        for i in range(7):
+            self.insert(f"u{i}", f"2020-01-0{i + 1} 00:00:00.000")
+
+        stream = changes.stream_changes(self.checkpoint, page_size=3, lag=0.0,
+                                        connection=self.connection)
+        first = [next(stream)["user_id"] for _ in range(5)]
+        stream.close()
+        self.assertEqual(first, ["u0", "u1", "u2", "u3", "u4"])
+        # seule la première page est validée : la seconde est relue
+        self.assertEqual(self.ids(page_size=3), ["u3", "u4", "u5", "u6"])
+
+        changes.save_checkpoint(self.checkpoint,
+                                {"updated_at": "2020-01-05 00:00:00.000",
+                                 "user_id": "u4"})
+        self.assertEqual(self.ids(page_size=3), ["u5", "u6"])
+
+    def test_ties_on_updated_at(self):
+        """Rows sharing an updated_at are ordered by user_id, across pages"""
+        for user_id in ["u3", "u0", "u4", "u1", "u2"]:
+            self.insert(user_id)
+        self.insert("u5", "2020-01-02 00:00:00.000")
+
+        self.assertEqual(self.ids(page_size=2),
+                         ["u0", "u1", "u2", "u3", "u4", "u5"])
+
+        changes.save_checkpoint(self.checkpoint,
+                                {"updated_at": OLD, "user_id": "u2"})
+        self.assertEqual(self.ids(page_size=2), ["u3", "u4", "u5"])
+
+    def test_recent_rows_wait_for_lag(self):
+        """Rows newer than `lag` seconds are left for the next run"""
+        self.insert("u0")
+        self.connection.execute(
+            "INSERT INTO user_data (user_id, name, email, age) "
+            "VALUES ('u1', 'name u1', 'u1@example.com', 30)")
+        self.connection.commit()
+
+        self.assertEqual(self.ids(lag=60.0), ["u0"])
+        self.assertEqual(self.ids(lag=0.0), ["u1"])
+
+
+if __name__ == "__main__":
+    unittest.main()